@@ -1,14 +1,22 @@
 from __future__ import absolute_import
 
 import logging
+import threading
+
+from collections import OrderedDict
 
 from django.core.exceptions import ValidationError
 from django.utils.translation import ugettext_lazy as _
 from django import forms
-from .jira import JIRAClient, JIRAError
+from .jira import AsyncJIRAClient, Deadline, JIRAClient, JIRAError
 
 log = logging.getLogger(__name__)
 
+# Metadata needed to render a form is fetched concurrently, all of it has to
+# come back within this many seconds, as long as a single metadata call may
+# take.
+PREFETCH_TIMEOUT = JIRAClient.DEADLINES['metadata']
+
 
 class JIRAFormUtils(object):
     @staticmethod
@@ -56,16 +64,35 @@ class JIRAOptionsForm(forms.Form):
         help_text=_("Automatically create a JIRA ticket for EVERY new issue"),
         required=False
     )
+    autocomplete_delay = forms.IntegerField(
+        label=_("Autocomplete Delay"),
+        widget=forms.TextInput(attrs={'class': 'span2', 'placeholder': '250'}),
+        help_text=_("Milliseconds to wait for typing to pause before looking up users"),
+        min_value=0,
+        required=False
+    )
+    autocomplete_min_length = forms.IntegerField(
+        label=_("Autocomplete Minimum Length"),
+        widget=forms.TextInput(attrs={'class': 'span2', 'placeholder': '0'}),
+        help_text=_("Characters to type before users are looked up (0 lists them all)"),
+        min_value=0,
+        required=False
+    )
 
     def __init__(self, data=None, *args, **kwargs):
 
         super(JIRAOptionsForm, self).__init__(data=data, *args, **kwargs)
 
         initial = kwargs.get("initial") or {}
+        saved = dict(initial)
         for key, value in self.data.items():
             initial[key.lstrip(self.prefix or '')] = value
 
-        has_credentials = all(initial.get(k) for k in ('instance_url', 'username', 'password'))
+        credentials = ('instance_url', 'username', 'password')
+        has_credentials = all(initial.get(k) for k in credentials)
+        # submitted credentials haven't been checked yet, a wrong password
+        # should cost JIRA a single failed login rather than one per call.
+        credentials_saved = all(initial.get(k) == saved.get(k) for k in credentials)
         project_safe = False
         can_auto_create = False
 
@@ -73,10 +100,25 @@ class JIRAOptionsForm(forms.Form):
         has_auto_create = 'auto_create' in initial
 
         if has_credentials:
-            jira = JIRAClient(initial['instance_url'], initial['username'], initial['password'])
+            jira = AsyncJIRAClient(initial['instance_url'], initial['username'], initial['password'])
+            deadline = Deadline(PREFETCH_TIMEOUT)
+
+            default_project = initial.get('default_project')
+
+            def prefetch():
+                if not has_auto_create:
+                    return None, None
+                return (jira.get_priorities(),
+                        jira.get_create_meta_for_project(default_project) if default_project else None)
+
+            # with saved credentials fire off everything we might need at
+            # once, rather than waiting on each call before making the next.
+            projects_result = jira.get_projects_list()
+            if credentials_saved:
+                priorities_result, meta_result = prefetch()
 
             try:
-                projects_response = jira.get_projects_list()
+                projects_response = deadline.wait(projects_result)
             except JIRAError as e:
                 if e.status_code == 401:
                     has_credentials = False
@@ -87,10 +129,12 @@ class JIRAOptionsForm(forms.Form):
                     project_safe = True
                     can_auto_create = True
                     self.fields["default_project"].choices = project_choices
+                    if not credentials_saved:
+                        priorities_result, meta_result = prefetch()
 
         if project_safe and has_auto_create:
             try:
-                priorities_response = jira.get_priorities()
+                priorities_response = deadline.wait(priorities_result)
             except JIRAError as e:
                 if e.status_code == 401:
                     has_credentials = False
@@ -100,10 +144,9 @@ class JIRAOptionsForm(forms.Form):
                     priority_choices = [(p.get('id'), "%s" % (p.get('name'))) for p in priorities]
                     self.fields["default_priority"].choices = priority_choices
 
-            default_project = initial.get('default_project')
             if default_project:
                 try:
-                    meta = jira.get_create_meta_for_project(default_project)
+                    meta = deadline.wait(meta_result)
                 except JIRAError as e:
                     if e.status_code == 401:
                         has_credentials = False
@@ -209,6 +252,138 @@ CUSTOM_FIELD_TYPES = {
 }
 
 
+# apply ordering to fields based on some known built-in JIRA fields.
+# otherwise weird ordering occurs.
+FIELD_ORDER = {
+    "priority": -150,
+    "fixVersions": -125,
+    "components": -100,
+    "security": -50,
+}
+
+# How many compiled field plans are kept around per process.
+FIELD_PLAN_CACHE_SIZE = 256
+
+
+def get_field_builder(field_meta):
+    """
+    Decide once how to build the form field for a JIRA field, returns a
+    callable making a new form field each time (or None if the field isn't
+    supported).
+    """
+    schema = field_meta["schema"]
+    # set up some defaults for form fields
+    fieldtype = forms.CharField
+    fkwargs = {
+        'label': field_meta["name"],
+        'required': field_meta["required"],
+    }
+    widget, widget_attrs = forms.TextInput, {'class': 'span6'}
+    # override defaults based on field configuration
+    if (schema["type"] in ["securitylevel", "priority"]
+            or schema.get("custom") == CUSTOM_FIELD_TYPES.get("select")):
+        fieldtype = forms.ChoiceField
+        fkwargs["choices"] = JIRAFormUtils.make_choices(field_meta.get('allowedValues'))
+        widget, widget_attrs = forms.Select, None
+    elif schema.get("items") == "user" or schema["type"] == "user":
+        widget_attrs = {
+            'class': 'user-selector',
+            'data-autocomplete': field_meta.get("autoCompleteUrl")
+        }
+    elif schema["type"] in ["timetracking"]:
+        # TODO: Implement timetracking (currently unsupported alltogether)
+        return None
+    elif schema.get("items") in ["worklog", "attachment"]:
+        # TODO: Implement worklogs and attachments someday
+        return None
+    elif schema["type"] == "array" and schema["items"] != "string":
+        fieldtype = forms.MultipleChoiceField
+        fkwargs["choices"] = JIRAFormUtils.make_choices(field_meta.get("allowedValues"))
+        widget, widget_attrs = forms.SelectMultiple, None
+
+    # break this out, since multiple field types could additionally
+    # be configured to use a custom property instead of a default.
+    if schema.get("custom"):
+        if schema["custom"] == CUSTOM_FIELD_TYPES.get("textarea"):
+            widget, widget_attrs = forms.Textarea, {'class': 'span6'}
+
+    def build():
+        return fieldtype(widget=widget(attrs=dict(widget_attrs or {})), **fkwargs)
+    return build
+
+
+def get_value_converter(schema):
+    """
+    Decide once how a submitted value is turned into what JIRA's API expects
+    for a field, returns a callable (or None to pass it through as is).
+    """
+    if schema.get("type") == "string" and not schema.get("custom") == CUSTOM_FIELD_TYPES["select"]:
+        return None  # noop
+    if schema["type"] == "user" or schema.get('items') == "user":
+        return lambda v: {"name": v}
+    elif schema.get("custom") == CUSTOM_FIELD_TYPES.get("multiuserpicker"):
+        # custom multi-picker
+        return lambda v: [{"name": v}]
+    elif schema["type"] == "array" and schema.get('items') != "string":
+        return lambda v: [{"id": vx} for vx in v]
+    elif schema["type"] == "array" and schema.get('items') == "string":
+        return lambda v: [v]
+    elif schema.get("custom") == CUSTOM_FIELD_TYPES.get("textarea"):
+        return None
+    elif (schema.get("type") != "string"
+            or schema.get('items') != "string"
+            or schema.get("custom") == CUSTOM_FIELD_TYPES.get("select")):
+        return lambda v: {"id": v}
+    return None
+
+
+class FieldPlan(object):
+    """
+    An issue type's fields compiled into form field builders (in display
+    order) and value converters, so that building and cleaning a form are
+    lookups rather than walking JIRA's schema again.
+    """
+    def __init__(self, fields):
+        field_ids = list(fields.keys())
+        field_ids.sort(key=lambda f: FIELD_ORDER.get(f) or 0)
+        self.builders = OrderedDict()
+        self.converters = OrderedDict()
+        for field_id in field_ids:
+            field_meta = fields[field_id]
+            builder = get_field_builder(field_meta)
+            if builder:
+                self.builders[field_id] = builder
+            self.converters[field_id] = get_value_converter(field_meta["schema"])
+
+
+_field_plans = OrderedDict()
+_field_plans_lock = threading.Lock()
+
+
+def get_field_plan(project_key, issue_type_id, fields):
+    """
+    The ``FieldPlan`` for an issue type, compiled once per version of its
+    metadata (see ``IssueTypeFields``).
+    """
+    version = getattr(fields, 'version', None)
+    if version is None:
+        return FieldPlan(fields)
+
+    key = (project_key, issue_type_id, version)
+    with _field_plans_lock:
+        plan = _field_plans.pop(key, None)
+        if plan is not None:
+            _field_plans[key] = plan
+            return plan
+
+    plan = FieldPlan(fields)
+    with _field_plans_lock:
+        _field_plans[key] = plan
+        while len(_field_plans) > FIELD_PLAN_CACHE_SIZE:
+            _field_plans.popitem(last=False)
+    return plan
+
+
 class JIRAIssueForm(forms.Form):
     project = forms.CharField(widget=forms.HiddenInput())
     issuetype = forms.ChoiceField(
@@ -231,13 +406,25 @@ class JIRAIssueForm(forms.Form):
         jira_client = kwargs.pop("jira_client")
         project_key = kwargs.pop("project_key")
 
-        priorities = jira_client.get_priorities().json
-        versions = jira_client.get_versions(project_key).json
+        jira = AsyncJIRAClient.from_client(jira_client)
+        deadline = Deadline(PREFETCH_TIMEOUT)
+        priorities = jira.get_priorities()
+        versions = jira.get_versions(project_key)
 
         # Returns the metadata the configured JIRA instance requires for
         # creating issues for a given project.
         # https://developer.atlassian.com/static/rest/jira/5.0.html#id200251
-        meta = jira_client.get_create_meta(project_key).json
+        meta = jira.get_create_meta(project_key)
+
+        # the fields of the issue type we are most likely to show can be
+        # fetched right away.
+        fields = None
+        if initial.get("issuetype"):
+            fields = jira.get_issue_type_fields(project_key, initial["issuetype"])
+
+        priorities = deadline.wait(priorities).json
+        versions = deadline.wait(versions).json
+        meta = deadline.wait(meta).json
 
         # Early exit, somehow made it here without properly configuring the
         # plugin.
@@ -270,6 +457,10 @@ class JIRAIssueForm(forms.Form):
         if not self.issue_type:
             self.issue_type = issue_types[0]
 
+        if fields is None or self.issue_type["id"] != initial.get("issuetype"):
+            fields = jira.get_issue_type_fields(project_key, self.issue_type["id"])
+        self.issue_type = dict(self.issue_type, fields=deadline.wait(fields))
+
         # set back after we've played with the inital data
         kwargs["initial"] = initial
 
@@ -279,24 +470,16 @@ class JIRAIssueForm(forms.Form):
         self.fields["project"].initial = project["id"]
         self.fields["issuetype"].choices = JIRAFormUtils.make_choices(issue_types)
 
-        # apply ordering to fields based on some known built-in JIRA fields.
-        # otherwise weird ordering occurs.
-        anti_gravity = {"priority": -150,
-                        "fixVersions": -125,
-                        "components": -100,
-                        "security": -50}
-
-        dynamic_fields = self.issue_type.get("fields").keys()
-        dynamic_fields.sort(key=lambda f: anti_gravity.get(f) or 0)
+        self.field_plan = get_field_plan(project_key, self.issue_type["id"],
+                                         self.issue_type["fields"])
+        ignored_fields = set(x.strip() for x in self.ignored_fields)
         # build up some dynamic fields based on required shit.
-        for field in dynamic_fields:
-            if field in self.fields.keys() or field in [x.strip() for x in self.ignored_fields]:
+        for field, build in self.field_plan.builders.items():
+            if field in self.fields or field in ignored_fields:
                 # don't overwrite the fixed fields for the form.
                 continue
-            mb_field = self.build_dynamic_field(self.issue_type["fields"][field])
-            if mb_field:
-                # apply field to form
-                self.fields[field] = mb_field
+            # apply field to form
+            self.fields[field] = build()
 
         if "priority" in self.fields.keys():
             # whenever priorities are available, put the available ones in the list.
@@ -326,33 +509,14 @@ class JIRAIssueForm(forms.Form):
         if not very_clean.get("issuetype"):
             raise ValidationError("Issue Type is required. Check your plugin configuration.")
 
-        fs = self.issue_type["fields"]
-        for field in fs.keys():
-            f = fs[field]
+        for field, convert in self.field_plan.converters.items():
             if field in ["description", "summary"]:
                 continue
-            if field in very_clean.keys():
+            if field in very_clean:
                 v = very_clean.get(field)
                 if v:
-                    schema = f["schema"]
-                    if schema.get("type") == "string" and not schema.get("custom") == CUSTOM_FIELD_TYPES["select"]:
-                        continue  # noop
-                    if schema["type"] == "user" or schema.get('items') == "user":
-                        v = {"name": v}
-                    elif schema.get("custom") == CUSTOM_FIELD_TYPES.get("multiuserpicker"):
-                        # custom multi-picker
-                        v = [{"name": v}]
-                    elif schema["type"] == "array" and schema.get('items') != "string":
-                        v = [{"id": vx} for vx in v]
-                    elif schema["type"] == "array" and schema.get('items') == "string":
-                        v = [v]
-                    elif schema.get("custom") == CUSTOM_FIELD_TYPES.get("textarea"):
-                        v = v
-                    elif (schema.get("type") != "string"
-                            or schema.get('items') != "string"
-                            or schema.get("custom") == CUSTOM_FIELD_TYPES.get("select")):
-                        v = {"id": v}
-                    very_clean[field] = v
+                    if convert is not None:
+                        very_clean[field] = convert(v)
                 else:
                     # We don't want to pass blank data back to the API, so kill
                     # None values
@@ -373,40 +537,5 @@ class JIRAIssueForm(forms.Form):
         """
         Builds a field based on JIRA's meta field information
         """
-        schema = field_meta["schema"]
-        # set up some defaults for form fields
-        fieldtype = forms.CharField
-        fkwargs = {
-            'label': field_meta["name"],
-            'required': field_meta["required"],
-            'widget': forms.TextInput(attrs={'class': 'span6'})
-        }
-        # override defaults based on field configuration
-        if (schema["type"] in ["securitylevel", "priority"]
-                or schema.get("custom") == CUSTOM_FIELD_TYPES.get("select")):
-            fieldtype = forms.ChoiceField
-            fkwargs["choices"] = JIRAFormUtils.make_choices(field_meta.get('allowedValues'))
-            fkwargs["widget"] = forms.Select()
-        elif schema.get("items") == "user" or schema["type"] == "user":
-            fkwargs["widget"] = forms.TextInput(attrs={
-                'class': 'user-selector',
-                'data-autocomplete': field_meta.get("autoCompleteUrl")
-            })
-        elif schema["type"] in ["timetracking"]:
-            # TODO: Implement timetracking (currently unsupported alltogether)
-            return None
-        elif schema.get("items") in ["worklog", "attachment"]:
-            # TODO: Implement worklogs and attachments someday
-            return None
-        elif schema["type"] == "array" and schema["items"] != "string":
-            fieldtype = forms.MultipleChoiceField
-            fkwargs["choices"] = JIRAFormUtils.make_choices(field_meta.get("allowedValues"))
-            fkwargs["widget"] = forms.SelectMultiple()
-
-        # break this out, since multiple field types could additionally
-        # be configured to use a custom property instead of a default.
-        if schema.get("custom"):
-            if schema["custom"] == CUSTOM_FIELD_TYPES.get("textarea"):
-                fkwargs["widget"] = forms.Textarea(attrs={'class': 'span6'})
-
-        return fieldtype(**fkwargs)
+        build = get_field_builder(field_meta)
+        return build() if build else None
@@ -1,78 +1,539 @@
 from __future__ import absolute_import
 
+import hashlib
 import logging
+import os
+import random
+import simplejson
+import threading
+import time
+import urllib
+import urlparse
+import zlib
 
-from requests.exceptions import ConnectionError, RequestException
-from sentry.http import build_session
+from cStringIO import StringIO
+from collections import OrderedDict, defaultdict
+from email.utils import mktime_tz, parsedate_tz
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+from requests.exceptions import ConnectionError, RequestException, Timeout
+from sentry.http import BlacklistAdapter, build_session
 from sentry.utils import json
-from sentry.utils.cache import cache
+from sentry.utils.cache import cache, memoize
 from simplejson.decoder import JSONDecodeError
 from BeautifulSoup import BeautifulStoneSoup
 from django.utils.datastructures import SortedDict
+from xml.etree import cElementTree
+
+from ijson.common import JSONError as StreamingJSONError
+
+try:
+    # the C backend is an order of magnitude faster, when yajl is around
+    import ijson.backends.yajl2_c as ijson
+except ImportError:
+    import ijson
 
 log = logging.getLogger(__name__)
 
-CACHE_KEY = "SENTRY-JIRA-%s-%s"
+CACHE_KEY = "SENTRY-JIRA-%s"
+
+# Cached response bodies larger than this (in bytes) are stored compressed.
+CACHE_COMPRESS_THRESHOLD = 1024
+
+
+def decode_json(text, ordered=True):
+    """
+    Decode a JSON body from JIRA, keeping key order with ``SortedDict``
+    unless ``ordered`` is False (which is quite a bit faster on big payloads).
+    """
+    if ordered:
+        # sentry's json.loads() silently drops object_pairs_hook
+        return simplejson.loads(text, object_pairs_hook=SortedDict)
+    return json.loads(text)
+
+
+def iter_xml_records(text, tag):
+    """
+    Stream the ``tag`` elements out of an XML body as dicts of their child
+    elements' text, without ever building the whole tree: every record is
+    dropped from memory as soon as it has been read.
+    """
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    depth = 0
+    for event, elem in cElementTree.iterparse(StringIO(text), events=('start', 'end')):
+        if elem.tag != tag:
+            continue
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 0:
+            yield dict((child.tag, child.text or u'') for child in elem)
+            elem.clear()
+
+
+def parse_retry_after(value):
+    """
+    Seconds to wait according to a ``Retry-After`` header, which is either a
+    number of seconds or an HTTP date.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        parsed = parsedate_tz(value)
+        if parsed is None:
+            return None
+        return max(mktime_tz(parsed) - time.time(), 0)
+
+
+class LazyPayloadMixin(object):
+    """
+    Decodes ``self.text`` into ``json`` (or ``xml``) on first access only, as
+    most callers only ever look at the status code.
+    """
+    ordered = True
+
+    @memoize
+    def json(self):
+        if not self.text:
+            return None
+        try:
+            return decode_json(self.text, self.ordered)
+        except (JSONDecodeError, ValueError):
+            # must be an awful code.
+            return None
+
+    @memoize
+    def xml(self):
+        if self.text and self.text[:5] == "<?xml":
+            # perhaps it's XML?
+            return BeautifulStoneSoup(self.text)
+        return None
+
+    def xml_records(self, tag):
+        """
+        The ``tag`` elements of an XML payload as a list of dicts (see
+        ``iter_xml_records``), a lot cheaper than walking ``xml``.
+        """
+        if not self.text or self.text[:5] != "<?xml":
+            return []
+        records = []
+        try:
+            records.extend(iter_xml_records(self.text, tag))
+        except SyntaxError:
+            # must be an awful code.
+            return []
+        return records
 
 
-class JIRAError(Exception):
+class JIRAError(LazyPayloadMixin, Exception):
     status_code = None
+    retry_after = None
 
-    def __init__(self, response_text, status_code=None):
+    def __init__(self, response_text, status_code=None, retry_after=None):
         if status_code is not None:
             self.status_code = status_code
         self.text = response_text
-        self.xml = None
-        if response_text:
-            try:
-                self.json = json.loads(response_text, object_pairs_hook=SortedDict)
-            except (JSONDecodeError, ValueError):
-                if self.text[:5] == "<?xml":
-                    # perhaps it's XML?
-                    self.xml = BeautifulStoneSoup(self.text)
-                # must be an awful code.
-                self.json = None
-        else:
-            self.json = None
+        self.retry_after = retry_after
         super(JIRAError, self).__init__(response_text[:128])
 
     @classmethod
     def from_response(cls, response):
-        return cls(response.text, response.status_code)
+        return cls(response.text, response.status_code,
+                   parse_retry_after(response.headers.get('Retry-After')))
 
 
 class JIRAUnauthorized(JIRAError):
     status_code = 401
 
 
-class JIRAResponse(object):
+class JIRAUnavailable(JIRAError):
+    """
+    Raised without contacting JIRA while its circuit breaker is open.
+    """
+    status_code = 503
+
+
+class JIRAResponse(LazyPayloadMixin):
     """
     A Slimy little wrapper around a python-requests response object that renders
     JSON from JIRA's ordered dicts (fields come back in order, but python obv.
     doesn't care)
     """
-    def __init__(self, response_text, status_code):
+    def __init__(self, response_text, status_code, ordered=True):
         self.text = response_text
-        self.xml = None
-        if response_text:
-            try:
-                self.json = json.loads(response_text, object_pairs_hook=SortedDict)
-            except (JSONDecodeError, ValueError):
-                if self.text[:5] == "<?xml":
-                    # perhaps it's XML?
-                    self.xml = BeautifulStoneSoup(self.text)
-                # must be an awful code.
-                self.json = None
-        else:
-            self.json = None
         self.status_code = status_code
+        self.ordered = ordered
+
+    def serialize(self):
+        """
+        Compact representation for the cache: only the status and the raw
+        body (compressed when large) are kept, parsing happens again lazily
+        once the response is read back.
+        """
+        text = self.text or u''
+        if len(text) > CACHE_COMPRESS_THRESHOLD:
+            return (self.status_code, True, zlib.compress(text.encode('utf-8')))
+        return (self.status_code, False, text)
+
+    @classmethod
+    def deserialize(cls, data, ordered=True):
+        status_code, compressed, payload = data
+        if compressed:
+            payload = zlib.decompress(payload).decode('utf-8')
+        return cls(payload, status_code, ordered)
+
+    @memoize
+    def checksum(self):
+        """
+        Fingerprint of the body, for anything derived from the response to
+        tell whether it changed.
+        """
+        return hashlib.md5((self.text or u'').encode('utf-8')).hexdigest()
 
     def __repr__(self):
         return "<JIRAResponse<%s> %s>" % (self.status_code, self.text[:120])
 
     @classmethod
-    def from_response(cls, response):
-        return cls(response.text, response.status_code)
+    def from_response(cls, response, ordered=True):
+        return cls(response.text, response.status_code, ordered)
+
+
+class StreamReader(object):
+    """
+    File-like view of a body arriving in chunks, for the incremental JSON
+    parser to read from. Unless ``compress`` is False (e.g. for a body which
+    comes out of the cache), what goes through is also compressed, so that
+    it can be cached without ever holding the whole body.
+    """
+    def __init__(self, chunks, compress=True):
+        self.chunks = iter(chunks)
+        self.buffer = b''
+        self.compress = compress
+        self.compressor = zlib.compressobj() if compress else None
+        self.compressed = []
+        self.closed = False
+        self.md5 = hashlib.md5()
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            if self.compress:
+                self.compressed.append(self.compressor.compress(chunk))
+            self.md5.update(chunk)
+            self.buffer += chunk
+        if size < 0:
+            data, self.buffer = self.buffer, b''
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    @property
+    def checksum(self):
+        return self.md5.hexdigest()
+
+    def close(self):
+        """
+        Read whatever the parser left over, returns the compressed body (or
+        None when not compressing).
+        """
+        if not self.closed:
+            while self.read(64 * 1024):
+                pass
+            if self.compress:
+                self.compressed = [b''.join(self.compressed) + self.compressor.flush()]
+            self.closed = True
+        return self.compressed[0] if self.compress else None
+
+
+def iter_cached_body(data, chunk_size=64 * 1024):
+    """
+    The body of a cached (``JIRAResponse.serialize``) response, decompressed
+    a chunk at a time.
+    """
+    status_code, compressed, payload = data
+    if not compressed:
+        yield payload.encode('utf-8')
+        return
+    decompressor = zlib.decompressobj()
+    for i in range(0, len(payload), chunk_size):
+        yield decompressor.decompress(payload[i:i + chunk_size])
+    yield decompressor.flush()
+
+
+class StreamedItems(list):
+    """
+    Objects picked out of a streamed body, ``checksum`` fingerprints the
+    whole body (see ``JIRAResponse.checksum``).
+    """
+    def __init__(self, items=(), checksum=None):
+        super(StreamedItems, self).__init__(items)
+        self.checksum = checksum
+
+
+class IssueTypeFields(OrderedDict):
+    """
+    The fields of an issue type by id, in JIRA's order. ``version`` changes
+    whenever JIRA's description of any of them does.
+    """
+    def __init__(self, fields=(), version=None):
+        super(IssueTypeFields, self).__init__(fields)
+        self.version = version
+
+
+class SessionPool(object):
+    """
+    Process-wide registry of keep-alive HTTP sessions, one per JIRA instance
+    and set of credentials, so consecutive requests reuse the same TCP/TLS
+    connections instead of handshaking on every call.
+
+    Sessions idle for longer than ``idle_timeout`` seconds are closed, and at
+    most ``max_sessions`` are kept around (least recently used goes first).
+    """
+    def __init__(self, max_sessions=64, pool_maxsize=10, idle_timeout=300):
+        self.max_sessions = max_sessions
+        self.pool_maxsize = pool_maxsize
+        self.idle_timeout = idle_timeout
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(instance_url, username, password):
+        auth = '%s:%s' % (username, password)
+        if isinstance(auth, unicode):
+            auth = auth.encode('utf-8')
+        return instance_url, hashlib.sha1(auth).hexdigest()
+
+    def build_session(self):
+        session = build_session()
+        adapter_kwargs = {
+            'pool_connections': 1,
+            'pool_maxsize': self.pool_maxsize,
+        }
+        session.mount('https://', BlacklistAdapter(**adapter_kwargs))
+        session.mount('http://', BlacklistAdapter(**adapter_kwargs))
+        return session
+
+    def get(self, instance_url, username, password):
+        key = self.make_key(instance_url, username, password)
+        now = time.time()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._sessions.pop(key, None)
+            if entry is not None:
+                self.hits += 1
+                session = entry[0]
+            else:
+                self.misses += 1
+                session = self.build_session()
+                while len(self._sessions) >= self.max_sessions:
+                    self._close(self._sessions.popitem(last=False)[1][0])
+            # re-inserting keeps the dict ordered by last use
+            self._sessions[key] = (session, now)
+        return session
+
+    def _evict_idle(self, now):
+        for key, (session, last_used) in self._sessions.items():
+            if now - last_used < self.idle_timeout:
+                # everything after this one was used more recently
+                break
+            del self._sessions[key]
+            self._close(session)
+
+    def _close(self, session):
+        self.evictions += 1
+        try:
+            session.close()
+        except Exception:
+            log.warning('Unable to close JIRA session', exc_info=True)
+
+    def clear(self):
+        with self._lock:
+            while self._sessions:
+                self._close(self._sessions.popitem()[1][0])
+
+    def stats(self):
+        return {
+            'sessions': len(self._sessions),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+sessions = SessionPool()
+
+
+class Deadline(object):
+    """
+    A single point in time several pending calls have to finish by.
+    """
+    def __init__(self, timeout):
+        self.expires = time.time() + timeout
+
+    def remaining(self):
+        return max(self.expires - time.time(), 0)
+
+    def wait(self, result):
+        """
+        Block on an ``AsyncResult`` for no longer than what is left of the
+        deadline.
+        """
+        try:
+            return result.get(self.remaining())
+        except TimeoutError:
+            raise JIRAError('Timed out waiting for JIRA', 504)
+
+
+class RateLimiter(object):
+    """
+    Caps the requests per second made to one JIRA instance by every process
+    sharing the cache backend. Calls are counted in one second windows,
+    which behaves like a token bucket refilled every second, and all
+    callers hold off while JIRA told us to (``Retry-After``).
+    """
+    def __init__(self, instance_url, rate):
+        self.rate = rate
+        self.key = 'jira-rate:%s' % hashlib.md5(instance_url.encode('utf-8')).hexdigest()
+
+    def acquire(self, deadline):
+        """
+        Wait for a free slot, raising a 429 ``JIRAError`` rather than waiting
+        past ``deadline``.
+        """
+        while True:
+            now = time.time()
+            blocked_until = cache.get('%s:blocked' % self.key)
+            if blocked_until and blocked_until > now:
+                wait = blocked_until - now
+            elif not self.rate:
+                return
+            else:
+                window = int(now)
+                key = '%s:%d' % (self.key, window)
+                if cache.add(key, 1, 2):
+                    return
+                try:
+                    if cache.incr(key) <= self.rate:
+                        return
+                except ValueError:
+                    # the window expired in between
+                    continue
+                wait = window + 1 - now
+            if wait > deadline.remaining():
+                raise JIRAError('Rate limit exceeded', 429)
+            time.sleep(wait)
+
+    def block(self, seconds):
+        """
+        Hold off every caller for ``seconds``.
+        """
+        cache.set('%s:blocked' % self.key, time.time() + seconds, int(seconds) + 1)
+
+
+class CircuitBreaker(object):
+    """
+    Stops talking to a JIRA instance which keeps failing, instead of having
+    every caller wait for it to time out.
+
+    After ``threshold`` consecutive failures (errors without a response,
+    timeouts and 5xx) the breaker opens and calls fail right away for
+    ``cooldown`` seconds. After that, a single probe request is let through:
+    if it succeeds the breaker closes again, otherwise it stays open for
+    another cooldown. The state lives in the cache, so every web and worker
+    process shares it.
+    """
+    def __init__(self, instance_url, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        key = 'jira-breaker:%s' % hashlib.md5(instance_url.encode('utf-8')).hexdigest()
+        self.failures_key = '%s:failures' % key
+        self.opened_key = '%s:opened' % key
+        self.probe_key = '%s:probe' % key
+
+    def is_open(self):
+        opened = cache.get(self.opened_key)
+        return opened is not None and time.time() - opened < self.cooldown
+
+    def allow(self):
+        """
+        Whether a request may go out right now.
+        """
+        opened = cache.get(self.opened_key)
+        if opened is None:
+            return True
+        if time.time() - opened < self.cooldown:
+            return False
+        # half-open: only one caller gets to probe
+        return cache.add(self.probe_key, 1, self.cooldown)
+
+    def record_success(self):
+        # the failure count may have expired during a long outage while the
+        # breaker is still open, either one means there is state to reset.
+        keys = [self.failures_key, self.opened_key, self.probe_key]
+        if any(cache.get_many(keys[:2]).values()):
+            cache.delete_many(keys)
+
+    def record_failure(self):
+        try:
+            failures = cache.incr(self.failures_key)
+        except ValueError:
+            cache.set(self.failures_key, 1, self.cooldown * 10)
+            failures = 1
+        if failures >= self.threshold:
+            if not self.is_open():
+                log.warning('JIRA circuit breaker opened after %d failures', failures)
+            cache.set(self.opened_key, time.time(), self.cooldown * 10)
+            cache.delete(self.probe_key)
+
+
+class SingleFlight(object):
+    """
+    Collapses concurrent calls for the same key into one: the first caller
+    runs the function and everyone arriving while it is running waits for
+    and shares its result (or exception).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event()}
+        if not leader:
+            call['done'].wait()
+            if 'error' in call:
+                raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = func(*args, **kwargs)
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+        return call['result']
+
+    def pending(self):
+        with self._lock:
+            return len(self._calls)
+
+
+requests_in_flight = SingleFlight()
 
 
 class JIRAClient(object):
@@ -82,23 +543,171 @@ class JIRAClient(object):
 
     PROJECT_URL = '/rest/api/2/project'
     META_URL = '/rest/api/2/issue/createmeta'
+    ISSUE_TYPES_URL = '/rest/api/2/issue/createmeta/%s/issuetypes'
+    ISSUE_TYPE_FIELDS_URL = '/rest/api/2/issue/createmeta/%s/issuetypes/%s'
     CREATE_URL = '/rest/api/2/issue'
+    BULK_CREATE_URL = '/rest/api/2/issue/bulk'
     PRIORITIES_URL = '/rest/api/2/priority'
     VERSIONS_URL = '/rest/api/2/project/%s/versions'
     USERS_URL = '/rest/api/2/user/assignable/search'
     ISSUE_URL = '/rest/api/2/issue/%s'
-    HTTP_TIMEOUT = 5
+    SEARCH_URL = '/rest/api/2/search'
+    SEARCH_PAGE_SIZE = 50
+    BULK_CREATE_SIZE = 50
+    FIELDS_PAGE_SIZE = 200
+    USERS_PAGE_SIZE = 100
+    session_pool = sessions
+    in_flight = requests_in_flight
+
+    # Requests per second allowed against a single instance, across all
+    # processes (None to disable).
+    RATE_LIMIT = 20
+    # Failures JIRA wants us to try again later on, either method can be
+    # retried on those as the request was turned away.
+    RETRY_STATUS_CODES = frozenset([429, 503])
+    # ... and GETs are also safe to retry on these.
+    RETRY_GET_STATUS_CODES = frozenset([502, 504])
+    MAX_RETRIES = 3
+    RETRY_BACKOFF = 0.5
+    RETRY_BACKOFF_MAX = 8
+    # (connect, read) timeouts in seconds of a single HTTP request, per kind
+    # of endpoint.
+    TIMEOUTS = {
+        'autocomplete': (2, 3),
+        'metadata': (3, 20),
+        'create': (3, 15),
+        'bulk': (5, 30),
+        'default': (3, 5),
+    }
+    # Overall seconds a call may take, including the rate limit, retries and
+    # backoff in between, per kind of endpoint.
+    DEADLINES = {
+        'autocomplete': 4,
+        'metadata': 30,
+        'create': 20,
+        'bulk': 60,
+        'default': 10,
+    }
+    # Consecutive failures after which calls to an instance fail fast, and
+    # for how many seconds.
+    BREAKER_THRESHOLD = 5
+    BREAKER_COOLDOWN = 30
+
+    # How long (in seconds) responses are cached for, per kind of endpoint.
+    PROJECTS_CACHE_TTL = 60 * 60 * 2
+    PRIORITIES_CACHE_TTL = 60 * 60 * 6
+    VERSIONS_CACHE_TTL = 60 * 10
+    META_CACHE_TTL = 60 * 5
+    USERS_CACHE_TTL = 60 * 5
+    AUTOCOMPLETE_CACHE_TTL = 15
+    DEFAULT_CACHE_TTL = 60
+    # How long metadata may be served past its TTL while being refreshed, and
+    # how long one process gets to refresh it before another may try.
+    STALE_TTL = 60 * 60 * 24
+    REFRESH_LOCK_TTL = 30
+    # How long an instance is remembered to lack the per issue type createmeta
+    # endpoints (JIRA before 7.13).
+    LEGACY_CREATEMETA_TTL = 60 * 60 * 6
+    # Seconds to wait on another process already fetching the same uncached
+    # response before fetching it ourselves (0 to only coalesce in-process).
+    SHARED_FETCH_WAIT = 0
 
     def __init__(self, instance_uri, username, password):
         self.instance_url = instance_uri.rstrip('/')
         self.username = username
         self.password = password
+        # overrides the deadline of every call when set (e.g. background jobs)
+        self.retry_budget = None
+        self.rate_limiter = RateLimiter(self.instance_url, self.RATE_LIMIT)
+        self.breaker = CircuitBreaker(self.instance_url, self.BREAKER_THRESHOLD,
+                                      self.BREAKER_COOLDOWN)
 
     def get_projects_list(self):
-        return self.get_cached(self.PROJECT_URL)
+        return self.get_cached(self.PROJECT_URL, ttl=self.PROJECTS_CACHE_TTL, ordered=False,
+                               endpoint='metadata', stale=True)
 
     def get_create_meta(self, project):
-        return self.make_request('get', self.META_URL, {'projectKeys': project, 'expand': 'projects.issuetypes.fields'})
+        """
+        The project and its issue types, without their fields (see
+        ``get_issue_type_fields``).
+        """
+        return self.get_cached(self.META_URL, self._create_meta_params(project),
+                               ttl=self.META_CACHE_TTL, endpoint='metadata', stale=True)
+
+    def _create_meta_params(self, project, issue_type=None):
+        if issue_type is None:
+            return {'projectKeys': project}
+        return {
+            'projectKeys': project,
+            'issuetypeIds': issue_type,
+            'expand': 'projects.issuetypes.fields',
+        }
+
+    def get_issue_type_fields(self, project, issue_type):
+        """
+        The fields of a single issue type, as a dict of field ids to their
+        metadata in JIRA's order. Uses the per issue type createmeta endpoint
+        where JIRA has it (7.13+ / Cloud), else the old one narrowed down to
+        the issue type.
+        """
+        if self.has_issue_type_createmeta(project):
+            return self._get_issue_type_fields(project, issue_type)
+
+        # the whole of it can still be huge on old instances.
+        issue_types = self.get_cached_items(
+            self.META_URL, self._create_meta_params(project, issue_type),
+            prefix='projects.item.issuetypes.item', ttl=self.META_CACHE_TTL,
+            endpoint='metadata', stale=True)
+        for issue_type_meta in issue_types:
+            if issue_type_meta['id'] == issue_type:
+                return IssueTypeFields(issue_type_meta['fields'], issue_types.checksum)
+        return IssueTypeFields(version=issue_types.checksum)
+
+    def has_issue_type_createmeta(self, project):
+        """
+        Whether JIRA has the per issue type createmeta endpoints, going by
+        the one listing a project's issue types: a 404 for a single issue
+        type says nothing about the instance. It is remembered per project,
+        as a project which is gone or hidden from the user 404s there too.
+        """
+        legacy_key = self._legacy_createmeta_key(project)
+        if cache.get(legacy_key):
+            return False
+        try:
+            self.get_cached(self.ISSUE_TYPES_URL % project, ttl=self.META_CACHE_TTL,
+                            ordered=False, endpoint='metadata', stale=True)
+        except JIRAError as e:
+            if e.status_code != 404:
+                raise
+            cache.set(legacy_key, True, self.LEGACY_CREATEMETA_TTL)
+            return False
+        return True
+
+    def _legacy_createmeta_key(self, project):
+        return 'jira-legacy-createmeta:%s' % hashlib.md5(
+            ('%s:%s' % (self.instance_url, project)).encode('utf-8')).hexdigest()
+
+    def _get_issue_type_fields(self, project, issue_type):
+        fields = IssueTypeFields()
+        checksums = []
+        start_at = 0
+        while True:
+            response = self.get_cached(self.ISSUE_TYPE_FIELDS_URL % (project, issue_type),
+                                       self._issue_type_fields_params(start_at),
+                                       ttl=self.META_CACHE_TTL, ordered=False,
+                                       endpoint='metadata', stale=True)
+            checksums.append(response.checksum)
+            page = response.json
+            values = page.get('values', [])
+            for field in values:
+                fields[field['fieldId']] = field
+            start_at += len(values)
+            if not values or page.get('isLast', start_at >= page.get('total', 0)):
+                fields.version = hashlib.md5(':'.join(checksums)).hexdigest()
+                return fields
+
+    def _issue_type_fields_params(self, start_at=0):
+        return {'startAt': start_at, 'maxResults': self.FIELDS_PAGE_SIZE}
 
     def get_create_meta_for_project(self, project):
         response = self.get_create_meta(project)
@@ -118,35 +727,255 @@ class JIRAClient(object):
             return None
 
     def get_versions(self, project):
-        return self.get_cached(self.VERSIONS_URL % project)
+        return self.get_cached(self.VERSIONS_URL % project, ttl=self.VERSIONS_CACHE_TTL,
+                               ordered=False, endpoint='metadata', stale=True)
 
     def get_priorities(self):
-        return self.get_cached(self.PRIORITIES_URL)
+        return self.get_cached(self.PRIORITIES_URL, ttl=self.PRIORITIES_CACHE_TTL,
+                               ordered=False, endpoint='metadata', stale=True)
+
+    def iter_assignable_users(self, project, start_at=0, page_size=None):
+        """
+        Iterate over the users issues of a project can be assigned to, from
+        the ``start_at``-th on. They are fetched (and cached) a page at a
+        time, only as far as the caller gets.
+        """
+        page_size = page_size or self.USERS_PAGE_SIZE
+        while True:
+            users = self.get_cached_items(self.USERS_URL,
+                                          self._users_params(project, start_at, page_size),
+                                          prefix='item', ttl=self.USERS_CACHE_TTL,
+                                          ordered=False, endpoint='autocomplete')
+            for user in users:
+                yield user
+            if len(users) < page_size:
+                return
+            start_at += len(users)
+
+    def _users_params(self, project, start_at=0, page_size=None):
+        return {
+            'project': project,
+            'startAt': start_at,
+            'maxResults': page_size or self.USERS_PAGE_SIZE,
+        }
 
     def get_users_for_project(self, project):
-        return self.make_request('get', self.USERS_URL, {'project': project})
+        return self.get_cached(self.USERS_URL, {'project': project}, ttl=self.USERS_CACHE_TTL,
+                               ordered=False, endpoint='autocomplete')
 
     def create_issue(self, raw_form_data):
         data = {'fields': raw_form_data}
-        return self.make_request('post', self.CREATE_URL, payload=data)
+        return self.make_request('post', self.CREATE_URL, payload=data, endpoint='create')
+
+    def create_issues(self, issues, chunk_size=None):
+        """
+        Create many issues (a list of ``fields`` dicts) through the bulk
+        endpoint, ``chunk_size`` per request. Returns a list matching
+        ``issues`` of either the created issue (with its ``key``) or the
+        ``JIRAError`` which kept it from being created.
+        """
+        chunk_size = chunk_size or self.BULK_CREATE_SIZE
+        results = []
+        for i in range(0, len(issues), chunk_size):
+            results.extend(self._create_issues(issues[i:i + chunk_size]))
+        return results
+
+    def _create_issues(self, issues):
+        data = {'issueUpdates': [{'fields': fields} for fields in issues]}
+        try:
+            body = self.make_request('post', self.BULK_CREATE_URL, payload=data,
+                                     ordered=False, endpoint='bulk').json or {}
+        except JIRAError as e:
+            # JIRA answers 400 when none of the issues could be created, with
+            # the same per issue errors as when only some failed.
+            if not (isinstance(e.json, dict) and e.json.get('errors')):
+                return [e] * len(issues)
+            body = e.json
+
+        results = [None] * len(issues)
+        for error in body.get('errors') or []:
+            try:
+                index = int(error.get('failedElementNumber'))
+            except (AttributeError, TypeError, ValueError):
+                index = None
+            if index is None or not 0 <= index < len(issues):
+                log.warning('Unexpected bulk create error from JIRA: %r', error)
+                continue
+            results[index] = JIRAError(
+                json.dumps(error.get('elementErrors') or {}), error.get('status'))
+        created = iter(body.get('issues') or [])
+        for i, result in enumerate(results):
+            if result is None:
+                results[i] = next(created, None) or JIRAError('', 500)
+        return results
 
     def get_issue(self, key):
-        return self.make_request('get', self.ISSUE_URL % key)
+        return self.make_request('get', self.ISSUE_URL % key, ordered=False)
+
+    def search_issues(self, jql, fields=('key',), start_at=0, max_results=None):
+        data = {
+            'jql': jql,
+            'fields': list(fields),
+            'startAt': start_at,
+            'maxResults': max_results or self.SEARCH_PAGE_SIZE,
+            # don't fail the whole search over keys which no longer exist
+            'validateQuery': False,
+        }
+        return self.make_request('post', self.SEARCH_URL, payload=data, ordered=False,
+                                 endpoint='bulk')
+
+    def resolve_issue_keys(self, keys, page_size=None):
+        """
+        Look up the current key of many (possibly renamed or moved) issues,
+        ``page_size`` keys per search. Returns a dict of the given keys to
+        their current ones, issues which can't be found are left out.
+        """
+        page_size = page_size or self.SEARCH_PAGE_SIZE
+        resolved = {}
+        for i in range(0, len(keys), page_size):
+            resolved.update(self._resolve_issue_keys(keys[i:i + page_size]))
+        return resolved
 
-    def make_request(self, method, url, payload=None):
+    def _resolve_issue_keys(self, keys):
+        jql = 'key in (%s)' % ', '.join('"%s"' % k.replace('"', '') for k in keys)
+        response = self.search_issues(jql, max_results=len(keys))
+        found = set(issue['key'] for issue in (response.json or {}).get('issues', []))
+        resolved = dict((k, k) for k in keys if k in found)
+        missing = [k for k in keys if k not in found]
+        renamed = found.difference(keys)
+        if not missing:
+            return resolved
+        if len(missing) == 1:
+            if renamed:
+                resolved[missing[0]] = renamed.pop()
+            else:
+                resolved.update(self._get_issue_key(missing[0]))
+            return resolved
+
+        # Renamed issues come back under their new key only. Renaming a
+        # project keeps the issue numbers, but moving an issue renumbers it
+        # and deleted ones don't come back at all, so sharing a number means
+        # little on its own. Pairs are only trusted when they account for
+        # every missing key and each old project maps onto a single new one,
+        # as after a rename; otherwise each half of the missing keys is
+        # searched for again, down to single keys JIRA is asked about.
+        pairs = self._pair_issue_keys(missing, renamed)
+        if pairs is not None:
+            resolved.update(pairs)
+            return resolved
+        half = len(missing) // 2
+        for part in (missing[:half], missing[half:]):
+            if len(part) == 1:
+                resolved.update(self._get_issue_key(part[0]))
+            else:
+                resolved.update(self._resolve_issue_keys(part))
+        return resolved
+
+    def _pair_issue_keys(self, missing, renamed):
+        by_number = defaultdict(list)
+        for key in renamed:
+            by_number[key.rsplit('-', 1)[-1]].append(key)
+        pairs = {}
+        projects = defaultdict(set)
+        for old_key in missing:
+            new_keys = by_number.get(old_key.rsplit('-', 1)[-1], ())
+            if len(new_keys) != 1:
+                return None
+            pairs[old_key] = new_keys[0]
+            projects[old_key.rsplit('-', 1)[0]].add(new_keys[0].rsplit('-', 1)[0])
+        if len(set(pairs.values())) != len(pairs) or any(len(p) > 1 for p in projects.values()):
+            return None
+        return pairs
+
+    def _get_issue_key(self, key):
+        try:
+            return {key: self.get_issue(key).json['key']}
+        except JIRAError as e:
+            if e.status_code != 404:
+                raise
+        return {}
+
+    def make_request(self, method, url, payload=None, ordered=True, endpoint='default',
+                     budget=None, deadline=None, stream=False):
+        """
+        Make a request, staying within the instance's rate limit and retrying
+        when JIRA asks us to back off. Fails fast with ``JIRAUnavailable``
+        while the instance's circuit breaker is open.
+
+        ``endpoint`` picks the connect/read timeouts of every attempt and the
+        overall deadline of the call, which every attempt, retry and wait has
+        to fit in. ``budget`` (seconds) or a shared ``deadline`` override the
+        latter.
+
+        With ``stream=True`` the body of a successful response is left unread
+        and the requests response is returned instead of a ``JIRAResponse``.
+        """
         if url[:4] != "http":
             url = self.instance_url + url
+        if deadline is None:
+            if budget is None:
+                budget = self.retry_budget or self.DEADLINES.get(endpoint, self.DEADLINES['default'])
+            deadline = Deadline(budget)
+        connect, read = self.TIMEOUTS.get(endpoint, self.TIMEOUTS['default'])
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise JIRAUnavailable('JIRA is currently unavailable, please try again later.')
+            self.rate_limiter.acquire(deadline)
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                raise JIRAError('Timed out waiting for JIRA', 504)
+            timeout = (min(connect, remaining), min(read, remaining))
+            try:
+                response = self._make_request(method, url, payload, ordered, timeout,
+                                              stream=stream)
+            except JIRAError as e:
+                if e.status_code is None or e.status_code >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                delay = self.get_retry_delay(method, e, attempt)
+                if delay is None or delay > deadline.remaining():
+                    raise
+                log.info('JIRA returned %s for %s, retrying in %.1fs', e.status_code, url, delay)
+                time.sleep(delay)
+                attempt += 1
+            else:
+                self.breaker.record_success()
+                return response
+
+    def get_retry_delay(self, method, error, attempt):
+        """
+        Seconds to wait before retrying after ``error``, or None if the
+        request shouldn't be retried. JIRA's ``Retry-After`` wins over our
+        own (jittered, exponential) backoff.
+        """
+        retry = error.status_code in self.RETRY_STATUS_CODES or (
+            method == 'get' and error.status_code in self.RETRY_GET_STATUS_CODES)
+        if not retry or attempt >= self.MAX_RETRIES:
+            return None
+        if error.retry_after is not None:
+            if error.status_code == 429:
+                self.rate_limiter.block(error.retry_after)
+            return error.retry_after
+        return random.uniform(0, min(self.RETRY_BACKOFF * 2 ** attempt, self.RETRY_BACKOFF_MAX))
+
+    def _make_request(self, method, url, payload=None, ordered=True, timeout=None,
+                      stream=False):
         auth = self.username, self.password
-        session = build_session()
+        session = self.session_pool.get(self.instance_url, self.username, self.password)
+        timeout = timeout or self.TIMEOUTS['default']
         try:
             if method == 'get':
                 r = session.get(
                     url, params=payload, auth=auth,
-                    verify=False, timeout=self.HTTP_TIMEOUT)
+                    verify=False, timeout=timeout, stream=stream)
             else:
                 r = session.post(
                     url, json=payload, auth=auth,
-                    verify=False, timeout=self.HTTP_TIMEOUT)
+                    verify=False, timeout=timeout, stream=stream)
+        except Timeout as e:
+            raise JIRAError(unicode(e), 504)
         except ConnectionError as e:
             raise JIRAError(unicode(e))
         except RequestException as e:
@@ -165,17 +994,305 @@ class JIRAClient(object):
             raise JIRAUnauthorized.from_response(r)
         elif r.status_code < 200 or r.status_code >= 300:
             raise JIRAError.from_response(r)
-        return JIRAResponse.from_response(r)
+        if stream:
+            return r
+        return JIRAResponse.from_response(r, ordered)
 
-    def get_cached(self, full_url):
+    def get_cached(self, full_url, params=None, ttl=None, ordered=True, endpoint='default',
+                   stale=False):
         """
-        Basic Caching mechanism for requests and responses. It only caches responses
-        based on URL
-        TODO: Implement GET attr in cache as well. (see self.create_meta for example)
+        Basic Caching mechanism for GET requests and responses. Responses are
+        cached per instance, credentials, URL and (normalized) GET params for
+        ``ttl`` seconds. Pass ``ordered=False`` when the order of JSON object
+        keys does not matter to get plain dicts back, ``endpoint`` is passed
+        on to ``make_request``.
+
+        With ``stale=True`` an expired response is kept around for another
+        ``STALE_TTL`` seconds and served right away while it is refreshed in
+        the background.
         """
-        key = CACHE_KEY % (full_url, self.instance_url)
+        key = self.get_cache_key(full_url, params)
         cached_result = cache.get(key)
-        if not cached_result:
-            cached_result = self.make_request('get', full_url)
-            cache.set(key, cached_result, 60)
-        return cached_result
+        if cached_result is not None:
+            fresh_until, data = cached_result
+            if fresh_until > time.time():
+                return JIRAResponse.deserialize(data, ordered)
+            if stale:
+                self.revalidate(full_url, params, ttl, endpoint)
+                return JIRAResponse.deserialize(data, ordered)
+        # identical requests made meanwhile by other threads share this one
+        return self.in_flight.do(
+            (key, ordered), self._fetch_once, key,
+            lambda: self.fetch(full_url, params, ttl, ordered, endpoint, stale),
+            lambda data: JIRAResponse.deserialize(data, ordered))
+
+    def _fetch_once(self, key, fetch, load):
+        """
+        Call ``fetch`` unless another process is fetching ``key`` already and
+        caches it within ``SHARED_FETCH_WAIT`` seconds, ``load`` then reads
+        the cached body.
+        """
+        if not self.SHARED_FETCH_WAIT:
+            return fetch()
+
+        lock_key = '%s:fetch' % key
+        if not cache.add(lock_key, 1, self.SHARED_FETCH_WAIT):
+            # someone else is on it, see if they get back in time
+            deadline = Deadline(self.SHARED_FETCH_WAIT)
+            while deadline.remaining():
+                time.sleep(min(0.05, deadline.remaining()))
+                cached_result = cache.get(key)
+                if cached_result is not None:
+                    return load(cached_result[1])
+            return fetch()
+        try:
+            return fetch()
+        finally:
+            cache.delete(lock_key)
+
+    def fetch(self, full_url, params=None, ttl=None, ordered=True, endpoint='default',
+              stale=False):
+        """
+        Make a GET request and cache its response, whatever is cached now.
+        """
+        result = self.make_request('get', full_url, params, ordered, endpoint=endpoint)
+        ttl = ttl or self.DEFAULT_CACHE_TTL
+        cache.set(self.get_cache_key(full_url, params),
+                  (time.time() + ttl, result.serialize()),
+                  ttl + self.STALE_TTL if stale else ttl)
+        return result
+
+    def get_cached_items(self, full_url, params=None, prefix='item', ttl=None, ordered=True,
+                         endpoint='default', stale=False):
+        """
+        Same as ``get_cached``, but the body is parsed as it streams in (or
+        out of the cache) and only the objects found at ``prefix`` (e.g.
+        ``projects.item.issuetypes.item``) are returned, so a big payload is
+        never held or decoded whole.
+        """
+        key = self.get_cache_key(full_url, params)
+        map_type = SortedDict if ordered else None
+        cached_result = cache.get(key)
+        if cached_result is not None:
+            fresh_until, data = cached_result
+            if fresh_until > time.time() or stale:
+                if fresh_until <= time.time():
+                    self.revalidate(full_url, params, ttl, endpoint)
+                return self._load_items(data, prefix, map_type)
+
+        return self.in_flight.do(
+            (key, prefix, ordered), self._fetch_once, key,
+            lambda: self._fetch_items(key, full_url, params, prefix, map_type, ttl, endpoint,
+                                      stale),
+            lambda data: self._load_items(data, prefix, map_type))
+
+    def _fetch_items(self, key, full_url, params, prefix, map_type, ttl, endpoint, stale):
+        response = self.make_request('get', full_url, params, endpoint=endpoint, stream=True)
+        try:
+            reader = StreamReader(response.iter_content(64 * 1024))
+            items = self._parse_items(reader, prefix, map_type)
+            payload = reader.close()
+        except RequestException as e:
+            raise JIRAError(unicode(e), 504)
+        finally:
+            response.close()
+
+        ttl = ttl or self.DEFAULT_CACHE_TTL
+        cache.set(key, (time.time() + ttl, (response.status_code, True, payload)),
+                  ttl + self.STALE_TTL if stale else ttl)
+        return items
+
+    def _load_items(self, data, prefix, map_type):
+        return self._parse_items(StreamReader(iter_cached_body(data), compress=False),
+                                 prefix, map_type)
+
+    def _parse_items(self, reader, prefix, map_type):
+        try:
+            items = list(ijson.items(reader, prefix, map_type=map_type))
+        except StreamingJSONError:
+            # must be an awful code.
+            items = []
+        reader.close()
+        return StreamedItems(items, reader.checksum)
+
+    def revalidate(self, full_url, params=None, ttl=None, endpoint='default'):
+        """
+        Refresh a cached response in the background, unless someone (in any
+        process) is refreshing it already. Returns the ``AsyncResult`` of the
+        refresh, or None if it was left to someone else.
+        """
+        lock_key = '%s:refresh' % self.get_cache_key(full_url, params)
+        if not cache.add(lock_key, 1, self.REFRESH_LOCK_TTL):
+            return None
+        return revalidation_workers.submit(self._revalidate, lock_key, full_url, params, ttl,
+                                           endpoint)
+
+    def _revalidate(self, lock_key, full_url, params, ttl, endpoint):
+        try:
+            self.fetch(full_url, params, ttl, ordered=False, endpoint=endpoint, stale=True)
+        except JIRAError as e:
+            # the lock is left to expire so a broken instance isn't hammered
+            log.warning('Unable to refresh %s from JIRA: %s', full_url, e.status_code)
+            return False
+        cache.delete(lock_key)
+        return True
+
+    def warm_metadata(self, project, within=0, issue_type=None):
+        """
+        Fetch the metadata the issue form needs for a JIRA project if it
+        isn't cached or expires in less than ``within`` seconds, including
+        the fields of ``issue_type`` if given.
+        """
+        resources = [
+            (self.PROJECT_URL, None, self.PROJECTS_CACHE_TTL),
+            (self.PRIORITIES_URL, None, self.PRIORITIES_CACHE_TTL),
+            (self.VERSIONS_URL % project, None, self.VERSIONS_CACHE_TTL),
+            (self.META_URL, self._create_meta_params(project), self.META_CACHE_TTL),
+        ]
+        warmed = 0
+        for url, params, ttl in resources:
+            cached_result = cache.get(self.get_cache_key(url, params))
+            if cached_result is None or cached_result[0] - within <= time.time():
+                self.fetch(url, params, ttl, ordered=False, endpoint='metadata', stale=True)
+                warmed += 1
+        if issue_type:
+            self.get_issue_type_fields(project, issue_type)
+        return warmed
+
+    def get_cache_key(self, full_url, params=None):
+        if full_url[:4] != "http":
+            full_url = self.instance_url + full_url
+        parsed = urlparse.urlsplit(full_url)
+        query = urlparse.parse_qsl(parsed.query, keep_blank_values=True)
+        for k, v in (params or {}).items():
+            if isinstance(v, (list, tuple)):
+                query.extend((k, x) for x in v)
+            else:
+                query.append((k, v))
+        query = sorted(
+            (k, v.encode('utf-8') if isinstance(v, unicode) else str(v))
+            for k, v in query
+        )
+        url = urlparse.urlunsplit(parsed[:3] + (urllib.urlencode(query), ''))
+        identity = SessionPool.make_key(self.instance_url, self.username, self.password)[1]
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+        return CACHE_KEY % hashlib.md5('%s\n%s' % (identity, url)).hexdigest()
+
+    def invalidate(self, full_url, params=None):
+        """
+        Drop a single cached response, e.g. after it is known to be stale.
+        """
+        cache.delete(self.get_cache_key(full_url, params))
+
+    def invalidate_project(self, project):
+        """
+        Drop every cached response which is specific to a JIRA project.
+        """
+        keys = [
+            self.get_cache_key(self.VERSIONS_URL % project),
+            self.get_cache_key(self.USERS_URL, {'project': project}),
+            self.get_cache_key(self.USERS_URL, self._users_params(project)),
+            self.get_cache_key(self.ISSUE_TYPES_URL % project),
+            self._legacy_createmeta_key(project),
+        ]
+        meta_key = self.get_cache_key(self.META_URL, self._create_meta_params(project))
+        cached_result = cache.get(meta_key)
+        if cached_result is not None:
+            meta = JIRAResponse.deserialize(cached_result[1], False).json or {}
+            for project_meta in meta.get('projects', []):
+                for issue_type in project_meta.get('issuetypes', []):
+                    keys.extend([
+                        self.get_cache_key(self.ISSUE_TYPE_FIELDS_URL % (project, issue_type['id']),
+                                           self._issue_type_fields_params()),
+                        self.get_cache_key(self.META_URL,
+                                           self._create_meta_params(project, issue_type['id'])),
+                    ])
+        keys.append(meta_key)
+        cache.delete_many(keys)
+
+
+class WorkerPool(object):
+    """
+    A bounded pool of threads to run blocking JIRA calls on. The threads are
+    only started on first use, and again after a fork since they don't
+    survive it.
+    """
+    def __init__(self, size=20):
+        self.size = size
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get_pool(self):
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ThreadPool(self.size)
+                self._pid = os.getpid()
+            return self._pool
+
+    def submit(self, func, *args, **kwargs):
+        return self.get_pool().apply_async(func, args, kwargs)
+
+
+workers = WorkerPool()
+
+# Background refreshes get a few threads of their own, so a slow JIRA can't
+# tie up the ones pages are waiting on.
+revalidation_workers = WorkerPool(size=4)
+
+
+class AsyncJIRAClient(object):
+    """
+    Same surface as ``JIRAClient``, but every call is queued on a bounded
+    worker pool and returns an ``AsyncResult`` right away. ``result.get()``
+    returns the ``JIRAResponse`` or raises the same ``JIRAError``s the
+    blocking client would, and responses go through the same cache.
+
+    Every call holds one of the pool's threads until JIRA answers, so a
+    process has at most ``workers.size`` (20) calls in flight and queues the
+    rest. Set ``workers.size`` before the first call to change that.
+    """
+    worker_pool = workers
+
+    def __init__(self, instance_uri, username, password):
+        self.client = JIRAClient(instance_uri, username, password)
+
+    @classmethod
+    def from_client(cls, client):
+        inst = cls.__new__(cls)
+        inst.client = client
+        return inst
+
+    def submit(self, func, *args, **kwargs):
+        return self.worker_pool.submit(func, *args, **kwargs)
+
+    def get_projects_list(self):
+        return self.submit(self.client.get_projects_list)
+
+    def get_create_meta(self, project):
+        return self.submit(self.client.get_create_meta, project)
+
+    def get_create_meta_for_project(self, project):
+        return self.submit(self.client.get_create_meta_for_project, project)
+
+    def get_issue_type_fields(self, project, issue_type):
+        return self.submit(self.client.get_issue_type_fields, project, issue_type)
+
+    def get_versions(self, project):
+        return self.submit(self.client.get_versions, project)
+
+    def get_priorities(self):
+        return self.submit(self.client.get_priorities)
+
+    def get_users_for_project(self, project):
+        return self.submit(self.client.get_users_for_project, project)
+
+    def create_issue(self, raw_form_data):
+        return self.submit(self.client.create_issue, raw_form_data)
+
+    def create_issues(self, issues, chunk_size=None):
+        return self.submit(self.client.create_issues, issues, chunk_size)
+
+    def get_issue(self, key):
+        return self.submit(self.client.get_issue, key)
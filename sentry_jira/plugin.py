@@ -1,18 +1,66 @@
-import logging
+import hashlib
 import urllib
 import urlparse
 
+from collections import OrderedDict
+from itertools import islice
+from uuid import uuid4
+from xml.sax.saxutils import escape
+
 from django.conf import settings
 from django.core.urlresolvers import reverse
+from django.db import IntegrityError, connections, router, transaction
 from django.utils.translation import ugettext_lazy as _
 from sentry.models import GroupMeta, Event
 from sentry.plugins.base import JSONResponse
 from sentry.plugins.bases.issue import IssuePlugin
+from sentry.utils.cache import cache
 from sentry.utils.http import absolute_uri
 
 from sentry_jira import VERSION as PLUGINVERSION
 from sentry_jira.forms import JIRAOptionsForm, JIRAIssueForm
-from sentry_jira.jira import JIRAClient, JIRAError
+from sentry_jira.jira import JIRAClient, JIRAError, JIRAUnavailable
+from sentry_jira.tasks import ISSUE_KEY_CHECK_QUEUED, ISSUE_KEY_CHECK_QUEUED_TTL, ISSUE_KEY_VERIFIED
+from sentry_jira.tasks import auto_create_issue, migrate_issue_keys, refresh_user_index, verify_issue_key
+from sentry_jira.users import UserIndex, user_directory
+
+# How long a group stays claimed by the first worker which saw it as new.
+AUTO_CREATE_CLAIM_TTL = 60 * 60
+
+# How often a missing or stale user index may be queued for a refresh.
+USER_INDEX_REFRESH_INTERVAL = 60 * 5
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def bulk_update_group_meta(values):
+    """
+    Rewrite the value of many ``GroupMeta`` rows (a dict of ids to new
+    values) with a single UPDATE statement.
+    """
+    using = router.db_for_write(GroupMeta)
+    connection = connections[using]
+    ids = list(values)
+    params = []
+    for gm_id in ids:
+        params.extend([gm_id, values[gm_id]])
+    params.extend(ids)
+    sql = 'UPDATE %s SET %s = CASE %s %s END WHERE %s IN (%s)' % (
+        connection.ops.quote_name(GroupMeta._meta.db_table),
+        connection.ops.quote_name('value'),
+        connection.ops.quote_name('id'),
+        ' '.join(['WHEN %s THEN %s'] * len(ids)),
+        connection.ops.quote_name('id'),
+        ', '.join(['%s'] * len(ids)),
+    )
+    with transaction.atomic(using=using):
+        connection.cursor().execute(sql, params)
 
 
 class JIRAPlugin(IssuePlugin):
@@ -29,6 +77,17 @@ class JIRAPlugin(IssuePlugin):
     new_issue_form = JIRAIssueForm
     create_issue_template = 'sentry_jira/create_jira_issue.html'
     plugin_misconfigured_template = 'sentry_jira/plugin_misconfigured.html'
+    # Users listed per page of the assignee dropdown before anything is typed.
+    USER_AUTOCOMPLETE_LIMIT = 50
+    # Users JIRA is asked for per autocomplete query, an answer with fewer
+    # is complete and also answers every longer query starting with it.
+    USER_SEARCH_LIMIT = 50
+    # How long (in seconds) those answers are reused for longer queries.
+    USER_SEARCH_CACHE_TTL = 60
+    # Defaults of the per project autocomplete settings, how long (in ms) to
+    # wait for typing to pause and how many characters it takes to search.
+    AUTOCOMPLETE_DELAY = 250
+    AUTOCOMPLETE_MIN_LENGTH = 0
 
     # Adding resource links for forward compatibility, still need to integrate
     # into existing `project_conf.html` template.
@@ -89,7 +148,7 @@ class JIRAPlugin(IssuePlugin):
     def get_issue_label(self, group, issue_id, **kwargs):
         return issue_id
 
-    def create_issue(self, request, group, form_data, **kwargs):
+    def create_issue(self, request, group, form_data, field_plan=None, **kwargs):
         """
         Form validation errors recognized server-side raise ValidationErrors,
         but when validation errors occur in JIRA they are simply attached to
@@ -99,31 +158,190 @@ class JIRAPlugin(IssuePlugin):
         try:
             issue_response = jira_client.create_issue(form_data)
         except JIRAError as e:
-            # return some sort of error.
-            errdict = {"__all__": None}
-            if e.status_code == 500:
-                errdict["__all__"] = ["JIRA Internal Server Error."]
-            elif e.status_code == 400:
-                for k in e.json["errors"].keys():
-                    errdict[k] = [e.json["errors"][k]]
-                errdict["__all__"] = [e.json["errorMessages"]]
-            else:
-                errdict["__all__"] = ["Something went wrong, Sounds like a configuration issue: code %s" % e.status_code]
-            return None, errdict
+            fields = field_plan.converters if field_plan is not None else form_data
+            if self.is_schema_error(e, fields):
+                # the cached metadata which built the form is out of date
+                # with what JIRA now expects.
+                jira_client.invalidate_project(self.get_option('default_project', group.project))
+            return None, self.get_create_errors(e)
         else:
             return issue_response.json.get("key"), None
 
+    def is_schema_error(self, e, fields):
+        """
+        Whether JIRA turned an issue down over fields other than ``fields``
+        (those of the issue type it was built from), i.e. the cached metadata
+        is out of date, rather than over what was filled in.
+        """
+        if e.status_code != 400 or not isinstance(e.json, dict):
+            return False
+        return any(field not in fields for field in e.json.get('errors') or ())
+
+    def get_create_errors(self, e):
+        """
+        The form errors for a ``JIRAError`` raised creating an issue.
+        """
+        # return some sort of error.
+        errdict = {"__all__": None}
+        payload = e.json if isinstance(e.json, dict) else {}
+        if e.status_code == 500:
+            errdict["__all__"] = ["JIRA Internal Server Error."]
+        elif e.status_code == 400:
+            errors = payload.get("errors")
+            for k, v in (errors.items() if isinstance(errors, dict) else ()):
+                errdict[k] = [v]
+            errdict["__all__"] = [payload.get("errorMessages") or []]
+        else:
+            errdict["__all__"] = ["Something went wrong, Sounds like a configuration issue: code %s" % e.status_code]
+        return errdict
+
+    def create_issues(self, request, groups, fields=None, **kwargs):
+        """
+        File a JIRA issue for each of many groups at once, e.g. everything a
+        bad deploy broke. The issues are built like the create form's initial
+        data (plus ``fields``, shared by all of them), sent through JIRA's
+        bulk endpoint and linked in a single write.
+
+        Returns a dict of group ids to ``(issue key, errors)`` as returned by
+        ``create_issue``. Groups which are linked already keep their issue.
+        """
+        linked = self.get_issue_keys(groups)
+        results = dict((group.id, (linked[group], None)) for group in groups if linked[group])
+
+        by_project = OrderedDict()
+        for group in groups:
+            if group.id not in results:
+                by_project.setdefault(group.project, []).append(group)
+
+        created = []
+        for project, project_groups in by_project.items():
+            created.extend(self._create_issues(request, project, project_groups, fields or {}))
+
+        # whatever JIRA created is linked before anything else can go wrong,
+        # or it would be created again when retried.
+        links = dict(
+            (group, result['key']) for group, result in created
+            if isinstance(result, dict) and result.get('key')
+        )
+        if links:
+            self.link_issues(links)
+
+        for project in by_project:
+            self._invalidate_on_schema_errors(project, [
+                result for group, result in created
+                if group.project_id == project.id and isinstance(result, JIRAError)
+            ])
+
+        for group, result in created:
+            if group in links:
+                results[group.id] = (links[group], None)
+            elif isinstance(result, JIRAError):
+                results[group.id] = (None, self.get_create_errors(result))
+            elif result is None:
+                results[group.id] = (None, {"__all__": ["No event to create the issue from."]})
+            else:
+                results[group.id] = (None, {"__all__": ["JIRA didn't return the created issue."]})
+        return results
+
+    def _create_issues(self, request, project, groups, fields):
+        """
+        Returns ``(group, result)`` pairs, the result being the issue JIRA
+        created, the ``JIRAError`` it gave instead or None if the group has
+        no event to create an issue from.
+        """
+        jira_client = self.get_jira_client(project)
+        project_key = self.get_option('default_project', project)
+        created = []
+        pending = []
+        for group in groups:
+            event = group.get_latest_event()
+            if event is None:
+                created.append((group, None))
+                continue
+            event.group = group
+            pending.append((group, event))
+        Event.objects.bind_nodes([e for _, e in pending], 'data')
+
+        issues = []
+        for group, event in pending:
+            initial = self.get_initial_form_data(request, group, event)
+            issue = {
+                'project': {'key': project_key},
+                'summary': initial['summary'],
+                'description': initial['description'],
+            }
+            if initial.get('priority'):
+                issue['priority'] = {'id': initial['priority']}
+            if initial.get('issuetype'):
+                issue['issuetype'] = {'id': initial['issuetype']}
+            issue.update(fields)
+            issues.append(issue)
+
+        results = jira_client.create_issues(issues) if issues else []
+        created.extend((group, result) for (group, _), result in zip(pending, results))
+        return created
+
+    def _invalidate_on_schema_errors(self, project, errors):
+        errors = [e for e in errors if e.status_code == 400]
+        issue_type = self.get_option('default_issue_type', project)
+        if not (errors and issue_type):
+            return
+        jira_client = self.get_jira_client(project)
+        project_key = self.get_option('default_project', project)
+        try:
+            fields = jira_client.get_issue_type_fields(project_key, issue_type)
+        except JIRAError:
+            return
+        if any(self.is_schema_error(e, fields) for e in errors):
+            jira_client.invalidate_project(project_key)
+
+    def link_issues(self, links):
+        """
+        Link many groups to their JIRA issue keys (a dict) in one write.
+        """
+        key = '%s:tid' % self.get_conf_key()
+        try:
+            with transaction.atomic(using=router.db_for_write(GroupMeta)):
+                GroupMeta.objects.bulk_create([
+                    GroupMeta(group=group, key=key, value=issue_key)
+                    for group, issue_key in links.items()
+                ])
+        except IntegrityError:
+            # someone linked some of them meanwhile, ours are newer.
+            for group, issue_key in links.items():
+                GroupMeta.objects.set_value(group, key, issue_key)
+        GroupMeta.objects.populate_cache(list(links))
+
     def get_issue_url(self, group, issue_id, **kwargs):
         instance = self.get_option('instance_url', group.project)
         return "%s/browse/%s" % (instance, issue_id)
 
+    def get_issue_keys(self, groups):
+        """
+        The key of the JIRA issue linked to each of ``groups`` (or None), as a
+        dict. Groups missing from ``GroupMeta``'s cache (which lasts for the
+        request or task) are looked up together in a single query, so pages
+        listing many groups can call this once up front and have every
+        ``actions`` call after it answered from memory.
+        """
+        key = '%s:tid' % self.get_conf_key()
+        missing = []
+        for group in groups:
+            try:
+                GroupMeta.objects.get_value(group, key)
+            except GroupMeta.CacheNotPopulated:
+                missing.append(group)
+        if missing:
+            GroupMeta.objects.populate_cache(missing)
+        return GroupMeta.objects.get_value_bulk(groups, key)
+
     def actions(self, request, group, action_list, **kwargs):
-        issue_key = GroupMeta.objects.get_value(group, '%s:tid' % self.get_conf_key(), None)
+        issue_key = self.get_issue_keys([group])[group]
         if not issue_key:
             action_list.append((self.get_new_issue_title(), self.get_url(group)))
         else:
             action_list.append(('View JIRA: %s' % issue_key, self.get_issue_url(group, issue_key)))
-            action_list.append(('Update Issue Key', self.get_url(group)))
+            action_list.append(('Update Issue Key', '%s?update_key=1' % self.get_url(group)))
         return action_list
 
     def view(self, request, group, **kwargs):
@@ -153,9 +371,15 @@ class JIRAPlugin(IssuePlugin):
                 'project': group.project,
             })
 
+        jira_client = self.get_jira_client(group.project)
+        jira_available = not jira_client.breaker.is_open()
+
         issue_key = GroupMeta.objects.get_value(group, '%s:tid' % self.get_conf_key(), None)
         if issue_key:
-            self.update_issue_key(group)
+            if jira_available:
+                # the redirect doesn't wait for JIRA, renames are picked up
+                # in the background.
+                self.queue_issue_key_check(group, force=bool(request.GET.get('update_key')))
             return self.redirect(reverse('sentry-group', args=[
                 group.organization.slug, group.project.slug, group.id
             ]))
@@ -163,9 +387,18 @@ class JIRAPlugin(IssuePlugin):
         #######################################################################
         # Auto-complete handler
         if request.GET.get("user_autocomplete"):
+            if not jira_available:
+                return JSONResponse({'users': []})
             return self.handle_user_autocomplete(request, group, **kwargs)
         #######################################################################
 
+        # Don't bother building the form if JIRA is known to be down.
+        if not jira_available:
+            return self.render(self.plugin_misconfigured_template, {
+                'errorMessages': ['JIRA is currently unavailable, please try again later.'],
+                'title': self.get_new_issue_title(),
+            })
+
         prefix = self.get_conf_key()
         event = group.get_latest_event()
         Event.objects.bind_nodes([event], 'data')
@@ -175,13 +408,18 @@ class JIRAPlugin(IssuePlugin):
             form = self.new_issue_form(
                 request.POST or None,
                 initial=self.get_initial_form_data(request, group, event),
-                jira_client=self.get_jira_client(group.project),
+                jira_client=jira_client,
                 project_key=self.get_option('default_project', group.project),
                 ignored_fields=self.get_option("ignored_fields", group.project)
             )
         except JIRAError as e:
+            if isinstance(e, JIRAUnavailable):
+                # someone else is finding out whether JIRA is back
+                error_messages = [e.text]
+            else:
+                error_messages = e.json.get('errorMessages', []) if e.json else []
             context = {
-                'errorMessages': e.json.get('errorMessages', []) if e.json else [],
+                'errorMessages': error_messages,
                 'title': self.get_new_issue_title(),
             }
             return self.render(self.plugin_misconfigured_template, context)
@@ -194,6 +432,7 @@ class JIRAPlugin(IssuePlugin):
                     group=group,
                     form_data=form.cleaned_data,
                     request=request,
+                    field_plan=form.field_plan,
                 )
                 if error:
                     form.errors.update(error)
@@ -221,10 +460,18 @@ class JIRAPlugin(IssuePlugin):
         context = {
             'form': form,
             'title': self.get_new_issue_title(),
+            'autocomplete_delay': self.get_autocomplete_option(
+                'autocomplete_delay', group.project, self.AUTOCOMPLETE_DELAY),
+            'autocomplete_min_length': self.get_autocomplete_option(
+                'autocomplete_min_length', group.project, self.AUTOCOMPLETE_MIN_LENGTH),
         }
 
         return self.render(self.create_issue_template, context)
 
+    def get_autocomplete_option(self, key, project, default):
+        value = self.get_option(key, project)
+        return default if value is None else value
+
     def handle_user_autocomplete(self, request, group, **kwargs):
         """
         Auto-complete JSON handler, Tries to handle multiple different types of
@@ -241,15 +488,37 @@ class JIRAPlugin(IssuePlugin):
         jira_client = self.get_jira_client(group.project)
 
         project = self.get_option('default_project', group.project)
+        # the index only knows the assignable users, other user pickers (e.g.
+        # reporter) search everyone JIRA has.
+        index = None
+        if "/user/assignable/search" in parsed[2]:
+            index = self.get_user_index(jira_client, group.project, project)
         # shortcut case for no input since JIRA's API doesn't return all users
         if q == '':
-            return self._get_all_users_for_project(jira_client, project)
+            try:
+                page = max(int(request.GET.get('page') or 1), 1)
+            except ValueError:
+                page = 1
+            return self._get_all_users_for_project(jira_client, project, page, index)
+
+        # answer from the local index when it knows anyone matching, JIRA is
+        # only asked about who it doesn't know.
+        if index is not None:
+            users = index.search(q, limit=self.USER_AUTOCOMPLETE_LIMIT)
+            if users:
+                return JSONResponse({'users': [self._format_user(user, q) for user in users]})
 
         if "/rest/api/latest/user/" in url:  # its the JSON version of the autocompleter
             isXML = False
+            # a complete answer for the start of the query has every user
+            # matching the rest of it too.
+            users = self.get_prefix_cached_users(jira_client, url, q)
+            if users is not None:
+                return JSONResponse({'users': [self._format_user(user, q) for user in users]})
             query["username"] = q.encode('utf8')
             query.pop('issueKey', False)  # some reason JIRA complains if this key is in the URL.
             query["project"] = project.encode('utf8')
+            query["maxResults"] = self.USER_SEARCH_LIMIT
         else:  # its the stupid XML version of the API.
             isXML = True
             query["query"] = q.encode('utf8')
@@ -259,38 +528,86 @@ class JIRAPlugin(IssuePlugin):
         parsed[3] = urllib.urlencode(query)
         final_url = urlparse.urlunsplit(parsed)
 
-        autocomplete_response = jira_client.get_cached(final_url)
+        autocomplete_response = jira_client.get_cached(
+            final_url, ttl=jira_client.AUTOCOMPLETE_CACHE_TTL, endpoint='autocomplete')
         users = []
 
         if isXML:
-            for userxml in autocomplete_response.xml.findAll("users"):
+            for user in autocomplete_response.xml_records("users"):
                 users.append({
-                    'value': userxml.find("name").text,
-                    'display': userxml.find("html").text,
+                    'value': user.get("name", u''),
+                    # the page decodes this as HTML, as it came in the XML
+                    'display': escape(user.get("html", u'')),
                     'needsRender': False,
                     'q': q,
                 })
         else:
-            for user in autocomplete_response.json:
-                users.append({
-                    'value': user["name"],
-                    'display': "%s - %s (%s)" % (user["displayName"], user["emailAddress"], user["name"]),
-                    'needsRender': True,
-                    'q': q,
-                })
+            found = [(user["name"], user["displayName"], user["emailAddress"])
+                     for user in autocomplete_response.json or []]
+            cache.set(self._user_search_key(jira_client, url, q),
+                      (len(found) < self.USER_SEARCH_LIMIT, found), self.USER_SEARCH_CACHE_TTL)
+            users.extend(self._format_user(user, q) for user in found)
 
         return JSONResponse({'users': users})
 
-    def _get_all_users_for_project(self, client, project):
-        users = []
-        for user in client.get_users_for_project(project).json:
-            users.append({
-                'value': user['name'],
-                'display': '%s - %s (%s)' % (user['displayName'], user['emailAddress'], user['name']),
-                'needsRender': True,
-                'q': '',
-            })
-        return JSONResponse({'users': users})
+    def _get_all_users_for_project(self, client, project, page=1, index=None):
+        # one page of the dropdown at a time, JIRA is asked for no more than
+        # it takes to fill it (and tell whether there is more).
+        limit = self.USER_AUTOCOMPLETE_LIMIT
+        offset = (page - 1) * limit
+        if index is not None:
+            users = index.users[offset:offset + limit + 1]
+        else:
+            users = [
+                (u['name'], u['displayName'], u['emailAddress'])
+                for u in islice(client.iter_assignable_users(project, start_at=offset), limit + 1)
+            ]
+        return JSONResponse({
+            'users': [self._format_user(user, '') for user in users[:limit]],
+            'more': len(users) > limit,
+        })
+
+    def _format_user(self, user, q):
+        name, display_name, email = user
+        return {
+            'value': name,
+            'display': '%s - %s (%s)' % (display_name, email, name),
+            'needsRender': True,
+            'q': q,
+        }
+
+    def _user_search_key(self, client, url, q):
+        identity = u'%s\n%s\n%s\n%s' % (client.instance_url, client.username, url, q.lower())
+        return 'jira-user-search:%s' % hashlib.md5(identity.encode('utf-8')).hexdigest()
+
+    def get_prefix_cached_users(self, client, url, q):
+        """
+        Users matching ``q`` out of the cached answer for ``q`` itself or for
+        the longest start of it JIRA answered completely, or None if there is
+        no such answer.
+        """
+        keys = [self._user_search_key(client, url, q[:i]) for i in range(len(q), 0, -1)]
+        cached = cache.get_many(keys)
+        for key in keys:
+            if key not in cached:
+                continue
+            complete, users = cached[key]
+            if key == keys[0]:
+                return users
+            if complete:
+                return UserIndex(users).search(q)
+        return None
+
+    def get_user_index(self, client, project, project_key):
+        """
+        The local index of the JIRA project's assignable users, or None if it
+        has yet to be fetched (or is stale) in which case a refresh is queued.
+        """
+        index = user_directory.get(client, project_key)
+        if index is None and cache.add('jira-users-refresh:%s' % project.id, 1,
+                                       USER_INDEX_REFRESH_INTERVAL):
+            refresh_user_index.delay(project_id=project.id)
+        return index
 
     def handle_issue_type_autocomplete(self, request, group):
         project = request.GET("project")
@@ -317,30 +634,55 @@ class JIRAPlugin(IssuePlugin):
 
         # XXX(dcramer): Sentry doesn't expect GroupMeta referenced here so we
         # need to populate the cache
-        GroupMeta.objects.populate_cache([group])
-        if GroupMeta.objects.get_value(group, '%s:tid' % self.get_conf_key(), None):
+        if self.get_issue_keys([group])[group]:
             return False
 
         return True
 
     def post_process(self, group, event, is_new, is_sample, **kwargs):
+        """
+        Hands auto-creation of the JIRA ticket off to a background task, so a
+        slow JIRA never holds up event processing.
+        """
         if not self.should_create(group, event, is_new):
             return
 
-        initial = self.get_initial_form_data({}, group, event)
-        default_priority = initial.get('priority')
-        default_issue_type = initial.get('issuetype')
+        default_priority = self.get_option('default_priority', group.project)
+        default_issue_type = self.get_option('default_issue_type', group.project)
         default_project = self.get_option('default_project', group.project)
 
         if not (default_priority and default_issue_type and default_project):
             return
 
+        # Several workers can see the same new group at once, only the one
+        # which claims it first queues the ticket. The token identifies that
+        # one creation attempt across retries.
+        token = uuid4().hex
+        if not cache.add('jira-auto-create:%s' % group.id, token, AUTO_CREATE_CLAIM_TTL):
+            return
+
+        auto_create_issue.delay(
+            group_id=group.id,
+            event_id=event.id,
+            project_key=default_project,
+            priority=default_priority,
+            issue_type=default_issue_type,
+            token=token,
+        )
+
+    def create_issue_from_event(self, group, event, project_key, priority, issue_type):
+        """
+        Create the JIRA ticket for a new group and link it. Returns the issue
+        key, or None if the JIRA project can't be found; JIRA failures are
+        raised as ``JIRAError``.
+        """
         jira_client = self.get_jira_client(group.project)
-        meta = jira_client.get_create_meta(default_project).json
+        meta = jira_client.get_create_meta(project_key).json
         if not meta or len(meta["projects"]) == 0:
-            return
+            return None
         project = meta["projects"][0]
 
+        initial = self.get_initial_form_data({}, group, event)
         post_data = {
             'project': {'id': project['id']},
             'summary': initial['summary'],
@@ -352,20 +694,39 @@ class JIRAPlugin(IssuePlugin):
         if interface:
             post_data['description'] += "\n{code}%s{code}" % interface.get_stacktrace(event, system_frames=False, max_frames=settings.SENTRY_MAX_STACKTRACE_FRAMES)
 
-        post_data['priority'] = {'id': default_priority}
-        post_data['issuetype'] = {'id': default_issue_type}
-
-        issue_id, error = self.create_issue(
-            request={},
-            group=group,
-            form_data=post_data)
+        post_data['priority'] = {'id': priority}
+        post_data['issuetype'] = {'id': issue_type}
 
-        if issue_id and not error:
+        issue_id = jira_client.create_issue(post_data).json.get("key")
+        if issue_id:
             prefix = self.get_conf_key()
             GroupMeta.objects.set_value(group, '%s:tid' % prefix, issue_id)
+        return issue_id
 
-        elif error:
-            logging.exception("Error creating JIRA ticket: %s" % error)
+    def find_issue_for_group(self, group, project_key):
+        """
+        Look for a ticket previously created for ``group`` in JIRA, going by
+        the link to the group every description starts with.
+        """
+        jira_client = self.get_jira_client(group.project)
+        url = absolute_uri(group.get_absolute_url())
+        jql = 'project = "%s" AND description ~ "\\"%s\\""' % (project_key, url)
+        issues = jira_client.search_issues(jql, max_results=1).json.get('issues')
+        return issues[0]['key'] if issues else None
+
+    def queue_issue_key_check(self, group, force=False):
+        """
+        Have the linked issue's key checked against JIRA in the background,
+        unless (short of ``force``) it was verified within the last
+        ``ISSUE_KEY_VERIFY_INTERVAL`` seconds, or a check is queued already.
+        Returns whether it was queued.
+        """
+        if not force and cache.get(ISSUE_KEY_VERIFIED % group.id) is not None:
+            return False
+        if not cache.add(ISSUE_KEY_CHECK_QUEUED % group.id, 1, ISSUE_KEY_CHECK_QUEUED_TTL):
+            return False
+        verify_issue_key.delay(group_id=group.id)
+        return True
 
     def update_issue_key(self, group):
         gm = GroupMeta.objects.get(group=group, key='%s:tid' % self.get_conf_key())
@@ -374,10 +735,48 @@ class JIRAPlugin(IssuePlugin):
         if resp.json['key'] != gm.value:
             gm.update(value=resp.json['key'])
 
-    def update_issue_keys(self, project):
-        groupmetas = GroupMeta.objects.filter(key='%s:tid' % self.get_conf_key())
+    def get_linked_issues(self, project):
+        """
+        Every ``GroupMeta`` linking a group of ``project`` to a JIRA issue.
+        """
+        return GroupMeta.objects.filter(
+            group__project=project,
+            key='%s:tid' % self.get_conf_key(),
+        )
+
+    def refresh_issue_keys(self, client, rows, batch_size=None):
+        """
+        Resolve the current JIRA key for a batch of ``(id, issue key)`` rows
+        and write back the ones which changed. Returns how many did.
+        """
+        resolved = client.resolve_issue_keys([value for _, value in rows], batch_size)
+        changes = dict(
+            (gm_id, resolved[value]) for gm_id, value in rows
+            if resolved.get(value, value) != value
+        )
+        if changes:
+            bulk_update_group_meta(changes)
+        return len(changes)
+
+    def update_issue_keys(self, project, batch_size=None, background=False, **kwargs):
+        """
+        Refresh the JIRA keys of every issue linked from ``project``, e.g.
+        after the JIRA project was renamed. Keys are resolved ``batch_size``
+        at a time through JIRA's search, and only rows whose key actually
+        changed are written back. Returns the number of updated rows.
+
+        With ``background`` the work is handed off to a resumable, partitioned
+        job instead (see ``sentry_jira.tasks.migrate_issue_keys`` for its
+        options) and nothing is returned.
+        """
+        if background:
+            migrate_issue_keys.delay(project_id=project.id, batch_size=batch_size, **kwargs)
+            return None
+
         client = self.get_jira_client(project)
-        for gm in groupmetas:
-            issue_key = gm.value
-            resp = client.get_issue(issue_key)
-            gm.update(value=resp.json['key'])
+        batch_size = batch_size or client.SEARCH_PAGE_SIZE
+        updated = 0
+        for chunk in chunked(self.get_linked_issues(project).values_list('id', 'value').iterator(),
+                             batch_size):
+            updated += self.refresh_issue_keys(client, chunk, batch_size)
+        return updated
@@ -0,0 +1,377 @@
+from __future__ import absolute_import
+
+import logging
+import time
+
+from django.db.models import Max, Min
+from sentry.app import locks
+from sentry.models import Event, Group, GroupMeta, Project, ProjectOption, ProjectStatus
+from sentry.plugins import plugins
+from sentry.tasks.base import instrumented_task
+from sentry.utils.cache import cache
+from sentry.utils.locking import UnableToAcquireLock
+
+from sentry_jira.jira import JIRAError
+from sentry_jira.users import user_directory
+
+log = logging.getLogger(__name__)
+
+# Statuses which won't go away by trying again later.
+FATAL_STATUS_CODES = frozenset([400, 401, 403, 404])
+
+# How long the outcome of an auto-create attempt is remembered by token.
+AUTO_CREATE_ATTEMPT_TTL = 60 * 60 * 24
+
+# Background jobs can afford to wait longer on JIRA's rate limits than
+# requests made while someone is looking at a page.
+BACKGROUND_RETRY_BUDGET = 60
+
+# How long a worker holds on to a key migration partition without reaching
+# its next checkpoint before the partition is given up for dead.
+PARTITION_LOCK_TTL = 60 * 10
+
+# How often ``warm_metadata_cache`` is expected to run, metadata expiring
+# before the next run is refreshed ahead of time.
+WARM_UP_INTERVAL = 60 * 5
+
+# How often the key of a linked issue is checked against JIRA for renames,
+# the time of the last successful check is kept under ``ISSUE_KEY_VERIFIED``.
+ISSUE_KEY_VERIFY_INTERVAL = 60 * 60
+ISSUE_KEY_VERIFIED = 'jira-issue-key-verified:%s'
+# How long a queued check holds off queueing another one for the same group.
+ISSUE_KEY_CHECK_QUEUED_TTL = 60
+ISSUE_KEY_CHECK_QUEUED = 'jira-issue-key-check-queued:%s'
+
+
+class IssueKeyMigration(object):
+    """
+    Resumable rewrite of every JIRA key linked from a project, split into
+    ``GroupMeta`` id ranges which are processed by separate tasks.
+
+    Progress is checkpointed into plugin options (one per partition, so
+    partitions never write over each other) after every batch, so a job
+    which died is picked up again from where it stopped. A partition is
+    locked while a worker runs it, the lock is renewed at every checkpoint
+    and lapses after ``PARTITION_LOCK_TTL`` if the worker died.
+    """
+    option = 'key_migration'
+
+    def __init__(self, project, plugin=None):
+        self.project = project
+        self.plugin = plugin or plugins.get('jira')
+
+    def get_job(self):
+        return self.plugin.get_option(self.option, self.project)
+
+    def get_partition(self, index):
+        return self.plugin.get_option('%s:%d' % (self.option, index), self.project)
+
+    def set_partition(self, index, state):
+        self.plugin.set_option('%s:%d' % (self.option, index), state, self.project)
+
+    def get_lock(self, index):
+        return locks.get('jira:key-migration:%s:%d' % (self.project.id, index),
+                         duration=PARTITION_LOCK_TTL)
+
+    def is_running(self, index):
+        try:
+            with self.get_lock(index).acquire():
+                return False
+        except UnableToAcquireLock:
+            return True
+
+    def running_partitions(self):
+        return [i for i in range(len(self.get_partitions())) if self.is_running(i)]
+
+    def get_partitions(self):
+        job = self.get_job()
+        if not job:
+            return []
+        return [self.get_partition(i) for i in range(job['partitions'])]
+
+    def plan(self, partitions, batch_size, rate_limit):
+        """
+        Split the linked issues into ``partitions`` id ranges of roughly the
+        same size and reset all progress.
+        """
+        rows = self.plugin.get_linked_issues(self.project)
+        bounds = rows.aggregate(lo=Min('id'), hi=Max('id'))
+        lo, hi = bounds['lo'] or 0, bounds['hi'] or 0
+        step = max((hi - lo) // partitions + 1, 1)
+        for index in range(partitions):
+            start = lo - 1 + index * step
+            end = min(start + step, hi)
+            self.set_partition(index, {
+                'start': start,
+                'end': end,
+                'cursor': start,
+                'total': rows.filter(id__gt=start, id__lte=end).count(),
+                'processed': 0,
+                'updated': 0,
+                'done': False,
+            })
+        self.plugin.set_option(self.option, {
+            'started': time.time(),
+            'partitions': partitions,
+            'batch_size': batch_size,
+            'rate_limit': rate_limit,
+        }, self.project)
+
+    def pending_partitions(self):
+        return [i for i, p in enumerate(self.get_partitions()) if p and not p['done']]
+
+    def run_partition(self, index):
+        """
+        Process one partition from its last checkpoint on, in batches of
+        ``batch_size``, making no more than ``rate_limit`` batches per
+        second across the whole job.
+        """
+        lock = self.get_lock(index)
+        try:
+            lock.acquire()
+        except UnableToAcquireLock:
+            # another worker is on it
+            return
+        held = True
+        try:
+            held = self._run_partition(index, lock)
+        finally:
+            if held:
+                lock.release()
+
+    def _run_partition(self, index, lock):
+        """
+        Returns whether the partition's lock is still held.
+        """
+        # read only once the partition is ours, so its checkpoint is current
+        job = self.get_job()
+        state = self.get_partition(index)
+        if not job or not state or state['done']:
+            return True
+
+        client = self.plugin.get_jira_client(self.project)
+        client.retry_budget = BACKGROUND_RETRY_BUDGET
+        interval = float(job['partitions']) / job['rate_limit'] if job['rate_limit'] else 0
+        rows = self.plugin.get_linked_issues(self.project).order_by('id').values_list('id', 'value')
+        while True:
+            batch_started = time.time()
+            batch = list(rows.filter(id__gt=state['cursor'], id__lte=state['end'])[:job['batch_size']])
+            if not batch:
+                state['done'] = True
+                self.set_partition(index, state)
+                return True
+
+            state['updated'] += self.plugin.refresh_issue_keys(client, batch, job['batch_size'])
+            state['processed'] += len(batch)
+            state['cursor'] = batch[-1][0]
+            self.set_partition(index, state)
+            self.log_progress()
+
+            # renew the lock for the next batch
+            lock.release()
+            try:
+                lock.acquire()
+            except UnableToAcquireLock:
+                # someone took over since, the rest is theirs
+                return False
+
+            wait = interval - (time.time() - batch_started)
+            if wait > 0:
+                time.sleep(wait)
+
+    def get_status(self):
+        """
+        Progress of the whole job: rows processed and updated so far, the
+        throughput in rows per second and the estimated seconds left.
+        """
+        job = self.get_job()
+        if not job:
+            return None
+        partitions = [p for p in self.get_partitions() if p]
+        total = sum(p['total'] for p in partitions)
+        processed = sum(p['processed'] for p in partitions)
+        elapsed = time.time() - job['started']
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        done = all(p['done'] for p in partitions)
+        return {
+            'total': total,
+            'processed': processed,
+            'updated': sum(p['updated'] for p in partitions),
+            'rate': rate,
+            'eta': 0 if done else ((total - processed) / rate if rate else None),
+            'done': done,
+        }
+
+    def log_progress(self):
+        status = self.get_status()
+        log.info(
+            'JIRA key migration for project %s: %d/%d rows (%d updated), %.1f rows/s, eta %s',
+            self.project.id, status['processed'], status['total'], status['updated'],
+            status['rate'], '%ds' % status['eta'] if status['eta'] is not None else 'unknown')
+
+
+@instrumented_task(name='sentry_jira.tasks.migrate_issue_keys')
+def migrate_issue_keys(project_id, partitions=4, batch_size=None, rate_limit=10,
+                       restart=False, **kwargs):
+    """
+    Rewrite the JIRA keys linked from a project in the background, e.g.
+    after the JIRA project was renamed. Unless ``restart`` is passed, an
+    unfinished earlier run is resumed rather than started over.
+    """
+    project = Project.objects.get(id=project_id)
+    migration = IssueKeyMigration(project)
+    running = migration.running_partitions()
+    pending = migration.pending_partitions()
+    if restart or not pending:
+        if running:
+            log.warning('Not restarting JIRA key migration for project %s, partitions %s are '
+                        'still running', project_id, running)
+            return
+        batch_size = batch_size or migration.plugin.get_jira_client(project).SEARCH_PAGE_SIZE
+        migration.plan(partitions, batch_size, rate_limit)
+        pending = migration.pending_partitions()
+
+    for index in pending:
+        if index not in running:
+            migrate_issue_keys_partition.delay(project_id=project_id, partition=index)
+
+
+@instrumented_task(name='sentry_jira.tasks.migrate_issue_keys_partition')
+def migrate_issue_keys_partition(project_id, partition, **kwargs):
+    project = Project.objects.get(id=project_id)
+    IssueKeyMigration(project).run_partition(partition)
+
+
+@instrumented_task(name='sentry_jira.tasks.auto_create_issue',
+                   default_retry_delay=60, max_retries=5)
+def auto_create_issue(group_id, event_id, project_key, priority, issue_type, token=None,
+                      **kwargs):
+    """
+    Create the JIRA ticket for a new group outside of event processing,
+    retrying with an increasing delay while JIRA is unavailable.
+
+    Creation is serialized per group with a lock, and ``token`` makes
+    retries idempotent: an attempt which might have reached JIRA without
+    us hearing back first looks for the ticket it may have created.
+    """
+    try:
+        group = Group.objects.get(id=group_id)
+    except Group.DoesNotExist:
+        return
+
+    lock = locks.get('jira:auto-create:%s' % group_id, duration=60)
+    try:
+        with lock.acquire():
+            _auto_create_issue(group, event_id, project_key, priority, issue_type, token)
+    except UnableToAcquireLock as e:
+        raise auto_create_issue.retry(exc=e)
+    except JIRAError as e:
+        if e.status_code in FATAL_STATUS_CODES:
+            log.error('Error creating JIRA ticket for group %s: %s', group_id,
+                      e.json or e.text)
+            return
+        countdown = auto_create_issue.default_retry_delay * 2 ** auto_create_issue.request.retries
+        raise auto_create_issue.retry(exc=e, countdown=countdown)
+
+
+def _auto_create_issue(group, event_id, project_key, priority, issue_type, token):
+    plugin = plugins.get('jira')
+    key = '%s:tid' % plugin.get_conf_key()
+    GroupMeta.objects.populate_cache([group])
+    if GroupMeta.objects.get_value(group, key, None):
+        return
+
+    attempt_key = 'jira-auto-create-attempt:%s' % (token or group.id)
+    if cache.get(attempt_key):
+        # an earlier attempt got as far as sending the ticket to JIRA
+        issue_id = plugin.find_issue_for_group(group, project_key)
+        if issue_id:
+            GroupMeta.objects.set_value(group, key, issue_id)
+            return
+
+    # the event might not have been stored (e.g. sampling)
+    event = None
+    if event_id is not None:
+        event = Event.objects.filter(id=event_id).first()
+    if event is None:
+        event = group.get_latest_event()
+    if event is None:
+        return
+    event.group = group
+    Event.objects.bind_nodes([event], 'data')
+
+    cache.set(attempt_key, True, AUTO_CREATE_ATTEMPT_TTL)
+    plugin.create_issue_from_event(group, event, project_key, priority, issue_type)
+
+
+@instrumented_task(name='sentry_jira.tasks.warm_metadata_cache')
+def warm_metadata_cache(**kwargs):
+    """
+    Pre-populate the JIRA metadata cache for every project with the plugin
+    configured, so that nobody opening the issue form pays for a cold
+    fetch. Meant to be run every ``WARM_UP_INTERVAL`` seconds, e.g. from
+    ``CELERYBEAT_SCHEDULE``.
+    """
+    plugin = plugins.get('jira')
+    project_ids = ProjectOption.objects.filter(
+        key='%s:default_project' % plugin.get_conf_key(),
+    ).values_list('project_id', flat=True)
+    projects = Project.objects.filter(id__in=list(project_ids), status=ProjectStatus.VISIBLE)
+    for project in projects:
+        if plugin.is_enabled(project) and plugin.is_configured(None, project):
+            warm_project_metadata.delay(project_id=project.id)
+
+
+@instrumented_task(name='sentry_jira.tasks.warm_project_metadata')
+def warm_project_metadata(project_id, **kwargs):
+    project = Project.objects.get(id=project_id)
+    plugin = plugins.get('jira')
+    client = plugin.get_jira_client(project)
+    project_key = plugin.get_option('default_project', project)
+    try:
+        client.warm_metadata(project_key, within=WARM_UP_INTERVAL,
+                             issue_type=plugin.get_option('default_issue_type', project))
+        age = user_directory.age(client, project_key)
+        if age is None or age + WARM_UP_INTERVAL >= user_directory.max_age:
+            client.retry_budget = BACKGROUND_RETRY_BUDGET
+            user_directory.refresh(client, project_key)
+    except JIRAError as e:
+        log.warning('Unable to warm JIRA metadata for project %s: %s', project_id,
+                    e.status_code)
+
+
+@instrumented_task(name='sentry_jira.tasks.refresh_user_index')
+def refresh_user_index(project_id, **kwargs):
+    """
+    Fetch every assignable user of a project's JIRA project for the local
+    autocomplete index.
+    """
+    project = Project.objects.get(id=project_id)
+    plugin = plugins.get('jira')
+    client = plugin.get_jira_client(project)
+    client.retry_budget = BACKGROUND_RETRY_BUDGET
+    try:
+        user_directory.refresh(client, plugin.get_option('default_project', project))
+    except JIRAError as e:
+        log.warning('Unable to fetch JIRA users for project %s: %s', project_id, e.status_code)
+
+
+@instrumented_task(name='sentry_jira.tasks.verify_issue_key')
+def verify_issue_key(group_id, **kwargs):
+    """
+    Check the key of the issue linked to a group against JIRA, following a
+    rename, and record when it was last verified.
+    """
+    try:
+        group = Group.objects.get(id=group_id)
+    except Group.DoesNotExist:
+        return
+
+    try:
+        plugins.get('jira').update_issue_key(group)
+    except GroupMeta.DoesNotExist:
+        return
+    except JIRAError as e:
+        log.warning('Unable to verify JIRA issue key for group %s: %s', group_id, e.status_code)
+        return
+    cache.set(ISSUE_KEY_VERIFIED % group_id, time.time(), ISSUE_KEY_VERIFY_INTERVAL)
@@ -0,0 +1,126 @@
+from __future__ import absolute_import
+
+import bisect
+import hashlib
+import threading
+import time
+import zlib
+
+from collections import OrderedDict
+from sentry.utils import json
+from sentry.utils.cache import cache
+
+
+class UserIndex(object):
+    """
+    In-memory prefix index over a project's assignable users. Users are found
+    by the start of their username, their email address or any word of their
+    display name, with a binary search over the sorted tokens.
+
+    ``users`` are ``(name, display name, email address)`` tuples, results
+    keep their order.
+    """
+    def __init__(self, users):
+        self.users = users
+        tokens = set()
+        for i, user in enumerate(users):
+            for token in self.tokenize(*user):
+                tokens.add((token, i))
+        tokens = sorted(tokens)
+        self.tokens = [t for t, _ in tokens]
+        self.positions = [i for _, i in tokens]
+
+    @staticmethod
+    def tokenize(name, display_name, email):
+        values = [name, display_name, email, email.split('@')[0]] + display_name.split()
+        return set(v.lower() for v in values if v)
+
+    def search(self, q, limit=None):
+        q = q.lower()
+        matches = set()
+        i = bisect.bisect_left(self.tokens, q)
+        while i < len(self.tokens) and self.tokens[i].startswith(q):
+            matches.add(self.positions[i])
+            i += 1
+        return [self.users[pos] for pos in sorted(matches)[:limit]]
+
+    def __len__(self):
+        return len(self.users)
+
+
+class UserDirectory(object):
+    """
+    Per project ``UserIndex``es. The user lists are fetched from JIRA in bulk
+    (see ``refresh``) and shared by every process through the cache, each
+    process builds its index once per version of the list.
+
+    Lists older than ``max_age`` seconds are considered stale, and at most
+    ``max_indexes`` indexes are kept in memory (least recently used goes
+    first).
+    """
+    def __init__(self, max_indexes=64, max_age=60 * 60, ttl=60 * 60 * 24):
+        self.max_indexes = max_indexes
+        self.max_age = max_age
+        self.ttl = ttl
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_key(self, client, project):
+        identity = '%s\n%s\n%s' % (client.instance_url, client.username, project)
+        if isinstance(identity, unicode):
+            identity = identity.encode('utf-8')
+        return 'jira-users:%s' % hashlib.md5(identity).hexdigest()
+
+    def refresh(self, client, project):
+        """
+        Fetch every assignable user of ``project`` from JIRA and store the
+        list for all processes to index. Returns the number of users.
+        """
+        users = [
+            (u['name'], u.get('displayName') or u'', u.get('emailAddress') or u'')
+            for u in client.iter_assignable_users(project)
+        ]
+        key = self.get_key(client, project)
+        fetched_at = time.time()
+        cache.set(key, (fetched_at, zlib.compress(json.dumps(users))), self.ttl)
+        cache.set('%s:fetched' % key, fetched_at, self.ttl)
+        return len(users)
+
+    def age(self, client, project):
+        """
+        Seconds since the users of ``project`` were last fetched, or None.
+        """
+        fetched_at = cache.get('%s:fetched' % self.get_key(client, project))
+        if fetched_at is None:
+            return None
+        return time.time() - fetched_at
+
+    def get(self, client, project):
+        """
+        The ``UserIndex`` of ``project``, or None if its users were never
+        fetched or are stale.
+        """
+        key = self.get_key(client, project)
+        fetched_at = cache.get('%s:fetched' % key)
+        if fetched_at is None or fetched_at + self.max_age < time.time():
+            return None
+
+        with self._lock:
+            version, index = self._indexes.pop(key, (None, None))
+            if version == fetched_at:
+                self._indexes[key] = (version, index)
+                return index
+
+        cached = cache.get(key)
+        if cached is None:
+            return None
+        fetched_at, payload = cached
+        index = UserIndex([tuple(u) for u in json.loads(zlib.decompress(payload))])
+        with self._lock:
+            self._indexes[key] = (fetched_at, index)
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+        return index
+
+
+user_directory = UserDirectory()
@@ -2,7 +2,8 @@
 from setuptools import setup, find_packages
 
 install_requires = [
-    'BeautifulSoup>=3.2.1'
+    'BeautifulSoup>=3.2.1',
+    'ijson>=2.5',
 ]
 
 tests_require = [
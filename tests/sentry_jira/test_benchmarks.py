@@ -0,0 +1,47 @@
+"""
+Micro-benchmarks, too slow for every run: ``make benchmark`` (or set
+``SENTRY_JIRA_BENCHMARKS=1``) to run them, ``-s`` shows the timings.
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import pytest
+import timeit
+
+from xml.sax.saxutils import escape
+
+from sentry_jira.jira import JIRAResponse
+
+benchmark = pytest.mark.skipif(not os.environ.get('SENTRY_JIRA_BENCHMARKS'),
+                               reason='SENTRY_JIRA_BENCHMARKS is not set')
+
+
+def make_user_picker_xml(count):
+    users = ''.join(
+        '<users><name>user%d</name><html>&lt;b&gt;Us&lt;/b&gt;er %d - '
+        'user%d@example.com (user%d)</html><displayName>User %d</displayName></users>'
+        % ((i,) * 5) for i in range(count)
+    )
+    return '<?xml version="1.0" encoding="UTF-8"?><userPickerResults>%s</userPickerResults>' % users
+
+
+def soup_users(text):
+    return [(u.find('name').text, u.find('html').text)
+            for u in JIRAResponse(text, 200).xml.findAll('users')]
+
+
+def streamed_users(text):
+    return [(u['name'], escape(u['html']))
+            for u in JIRAResponse(text, 200).xml_records('users')]
+
+
+@benchmark
+def test_user_picker_xml_parsing():
+    text = make_user_picker_xml(10000)
+    assert streamed_users(text) == soup_users(text)
+
+    soup = min(timeit.repeat(lambda: soup_users(text), number=1, repeat=3))
+    streamed = min(timeit.repeat(lambda: streamed_users(text), number=1, repeat=3))
+    print('\n10000 users: BeautifulStoneSoup %.3fs, iterparse %.3fs (%.0fx)'
+          % (soup, streamed, soup / streamed))
+    assert streamed < soup
@@ -0,0 +1,78 @@
+from __future__ import absolute_import
+
+import responses
+
+from django import forms
+from sentry.testutils import TestCase
+
+from sentry_jira.forms import CUSTOM_FIELD_TYPES, FieldPlan, JIRAOptionsForm, get_field_plan
+from sentry_jira.jira import IssueTypeFields
+
+
+def field(name, schema, required=False, **kwargs):
+    return dict(kwargs, name=name, required=required, schema=schema)
+
+
+class FieldPlanTest(TestCase):
+    fields = IssueTypeFields([
+        ('summary', field('Summary', {'type': 'string', 'system': 'summary'}, required=True)),
+        ('assignee', field('Assignee', {'type': 'user'}, autoCompleteUrl='/users?q=')),
+        ('timetracking', field('Time tracking', {'type': 'timetracking'})),
+        ('labels', field('Labels', {'type': 'array', 'items': 'string'})),
+        ('components', field('Components', {'type': 'array', 'items': 'component'},
+                             allowedValues=[{'id': '1', 'name': 'API'}])),
+        ('priority', field('Priority', {'type': 'priority'},
+                           allowedValues=[{'id': '2', 'name': 'High'}])),
+        ('customfield_1', field('Severity', {'type': 'option', 'custom': CUSTOM_FIELD_TYPES['select']},
+                                allowedValues=[{'id': '3', 'value': 'Bad'}])),
+    ], version='v1')
+
+    def test_orders_and_builds_fields(self):
+        plan = FieldPlan(self.fields)
+        assert plan.builders.keys() == [
+            'priority', 'components', 'summary', 'assignee', 'labels', 'customfield_1']
+
+        priority = plan.builders['priority']()
+        assert isinstance(priority, forms.ChoiceField)
+        assert priority.choices == [('2', 'High')]
+        assignee = plan.builders['assignee']()
+        assert assignee.widget.attrs['data-autocomplete'] == '/users?q='
+        # every form gets fields of its own
+        assert plan.builders['summary']() is not plan.builders['summary']()
+
+    def test_converts_values(self):
+        converters = FieldPlan(self.fields).converters
+        assert converters['summary'] is None
+        assert converters['assignee']('jane') == {'name': 'jane'}
+        assert converters['labels']('foo') == ['foo']
+        assert converters['components'](['1']) == [{'id': '1'}]
+        assert converters['priority']('2') == {'id': '2'}
+        assert converters['customfield_1']('3') == {'id': '3'}
+
+    def test_compiled_once_per_version(self):
+        plan = get_field_plan('SEN', '1', self.fields)
+        assert get_field_plan('SEN', '1', self.fields) is plan
+        assert get_field_plan('SEN', '2', self.fields) is not plan
+
+        changed = IssueTypeFields(self.fields, version='v2')
+        assert get_field_plan('SEN', '1', changed) is not plan
+
+
+class JIRAOptionsFormTest(TestCase):
+    saved = {
+        'instance_url': 'https://getsentry.atlassian.net',
+        'username': 'admin',
+        'password': 'secret',
+        'default_project': 'SEN',
+        'auto_create': False,
+    }
+
+    @responses.activate
+    def test_checks_submitted_credentials_first(self):
+        responses.add(responses.GET, 'https://getsentry.atlassian.net/rest/api/2/project',
+                      status=401, body='Unauthorized')
+        data = dict(self.saved, password='wrong')
+        form = JIRAOptionsForm(data, initial=dict(self.saved))
+        assert form.fields['password'].required
+        # one failed login, not one per call the form would have made
+        assert len(responses.calls) == 1
@@ -0,0 +1,665 @@
+from __future__ import absolute_import
+
+import mock
+import re
+import responses
+import threading
+import time
+import urlparse
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from itertools import islice
+
+from exam import fixture
+from requests.exceptions import Timeout
+from sentry.testutils import TestCase
+from sentry.utils import json
+from sentry.utils.cache import cache
+
+from sentry_jira.jira import (
+    AsyncJIRAClient, CircuitBreaker, Deadline, JIRAClient, JIRAError, JIRAResponse,
+    JIRAUnauthorized, JIRAUnavailable, RateLimiter, SessionPool, SingleFlight
+)
+
+
+class SessionPoolTest(TestCase):
+    def test_reuses_session_for_same_credentials(self):
+        pool = SessionPool()
+        session = pool.get('https://jira.example.com', 'foo', 'bar')
+        assert pool.get('https://jira.example.com', 'foo', 'bar') is session
+        assert pool.get('https://jira.example.com', 'foo', 'baz') is not session
+        assert pool.stats() == {
+            'sessions': 2,
+            'hits': 1,
+            'misses': 2,
+            'evictions': 0,
+        }
+
+    def test_evicts_least_recently_used(self):
+        pool = SessionPool(max_sessions=2)
+        first = pool.get('https://a.example.com', 'foo', 'bar')
+        pool.get('https://b.example.com', 'foo', 'bar')
+        pool.get('https://c.example.com', 'foo', 'bar')
+        assert pool.stats()['sessions'] == 2
+        assert pool.stats()['evictions'] == 1
+        assert pool.get('https://a.example.com', 'foo', 'bar') is not first
+
+    def test_evicts_idle_sessions(self):
+        pool = SessionPool(idle_timeout=0)
+        first = pool.get('https://jira.example.com', 'foo', 'bar')
+        assert pool.get('https://jira.example.com', 'foo', 'bar') is not first
+        assert pool.stats()['evictions'] == 1
+
+    @responses.activate
+    def test_client_uses_pool(self):
+        responses.add(responses.GET, 'https://jira.example.com/rest/api/2/priority',
+                      json=[])
+        client = JIRAClient('https://jira.example.com', 'foo', 'bar')
+        client.session_pool = SessionPool()
+        client.get_priorities()
+        client.make_request('get', client.PRIORITIES_URL)
+        assert client.session_pool.stats()['hits'] == 1
+        assert client.session_pool.stats()['misses'] == 1
+
+
+class JIRAClientCacheTest(TestCase):
+    @fixture
+    def jira(self):
+        return JIRAClient('https://jira.example.com', 'foo', 'bar')
+
+    def test_cache_key_normalizes_params(self):
+        client = self.jira
+        assert client.get_cache_key('/rest/api/2/user/assignable/search?project=SEN&username=a') == \
+            client.get_cache_key('/rest/api/2/user/assignable/search', {'username': 'a', 'project': 'SEN'})
+        assert client.get_cache_key(client.USERS_URL, {'project': 'SEN'}) != \
+            client.get_cache_key(client.USERS_URL, {'project': 'FOO'})
+        other = JIRAClient('https://jira.example.com', 'foo', 'baz')
+        assert client.get_cache_key(client.PRIORITIES_URL) != \
+            other.get_cache_key(client.PRIORITIES_URL)
+
+    @responses.activate
+    def test_caches_create_meta_per_project(self):
+        responses.add(responses.GET, 'https://jira.example.com/rest/api/2/issue/createmeta',
+                      json={'projects': []})
+        self.jira.get_create_meta('SEN')
+        self.jira.get_create_meta('SEN')
+        assert len(responses.calls) == 1
+        assert 'projectKeys=SEN' in responses.calls[0].request.url
+
+        self.jira.get_create_meta('FOO')
+        assert len(responses.calls) == 2
+
+        self.jira.invalidate_project('SEN')
+        self.jira.get_create_meta('SEN')
+        assert len(responses.calls) == 3
+
+    @responses.activate
+    def test_fetches_fields_per_issue_type(self):
+        responses.add(responses.GET,
+                      'https://jira.example.com/rest/api/2/issue/createmeta/SEN/issuetypes',
+                      json={'values': [{'id': '1'}]})
+        url = 'https://jira.example.com/rest/api/2/issue/createmeta/SEN/issuetypes/1'
+        responses.add(responses.GET, url, json={
+            'startAt': 0, 'total': 3, 'isLast': False,
+            'values': [{'fieldId': 'summary'}, {'fieldId': 'priority'}],
+        })
+        responses.add(responses.GET, url, json={
+            'startAt': 2, 'total': 3, 'isLast': True,
+            'values': [{'fieldId': 'customfield_1'}],
+        })
+        fields = self.jira.get_issue_type_fields('SEN', '1')
+        assert fields.keys() == ['summary', 'priority', 'customfield_1']
+        assert 'startAt=2' in responses.calls[2].request.url
+
+        # pages are cached
+        self.jira.get_issue_type_fields('SEN', '1')
+        assert len(responses.calls) == 3
+
+    @responses.activate
+    def test_missing_issue_type_is_not_legacy(self):
+        responses.add(responses.GET,
+                      'https://jira.example.com/rest/api/2/issue/createmeta/SEN/issuetypes',
+                      json={'values': [{'id': '1'}]})
+        responses.add(responses.GET,
+                      'https://jira.example.com/rest/api/2/issue/createmeta/SEN/issuetypes/9',
+                      status=404, json={})
+        with self.assertRaises(JIRAError):
+            self.jira.get_issue_type_fields('SEN', '9')
+        assert self.jira.has_issue_type_createmeta('SEN')
+
+    @responses.activate
+    def test_falls_back_to_filtered_create_meta(self):
+        responses.add(responses.GET,
+                      'https://jira.example.com/rest/api/2/issue/createmeta/SEN/issuetypes',
+                      status=404, json={})
+        responses.add(responses.GET, 'https://jira.example.com/rest/api/2/issue/createmeta', json={
+            'projects': [{'issuetypes': [{'id': '1', 'fields': {'summary': {}}}]}],
+        })
+        assert self.jira.get_issue_type_fields('SEN', '1').keys() == ['summary']
+        assert 'issuetypeIds=1' in responses.calls[1].request.url
+
+        # JIRA is remembered not to have the newer endpoint
+        self.jira.get_issue_type_fields('SEN', '2')
+        assert len(responses.calls) == 3
+        assert 'issuetypeIds=2' in responses.calls[2].request.url
+
+        # ... for that project only, it may just be gone or hidden
+        responses.add(responses.GET,
+                      'https://jira.example.com/rest/api/2/issue/createmeta/OPS/issuetypes',
+                      json={'values': [{'id': '1'}]})
+        assert self.jira.has_issue_type_createmeta('OPS')
+
+    @responses.activate
+    def test_streams_users_a_page_at_a_time(self):
+        users = [{'name': 'user%d' % i, 'displayName': u'User \xe9 %d' % i} for i in range(150)]
+
+        def search(request):
+            query = urlparse.parse_qs(urlparse.urlsplit(request.url).query)
+            start_at, max_results = int(query['startAt'][0]), int(query['maxResults'][0])
+            return 200, {}, json.dumps(users[start_at:start_at + max_results])
+
+        responses.add_callback(responses.GET,
+                               'https://jira.example.com/rest/api/2/user/assignable/search',
+                               callback=search)
+        assert list(self.jira.iter_assignable_users('SEN')) == users
+        assert len(responses.calls) == 2
+
+        # only as far as needed
+        assert list(islice(self.jira.iter_assignable_users('SEN', start_at=10), 5)) == users[10:15]
+        assert len(responses.calls) == 3
+
+        # pages are cached compressed, and readable by both
+        assert list(self.jira.iter_assignable_users('SEN')) == users
+        assert self.jira.get_cached(self.jira.USERS_URL, self.jira._users_params('SEN')).json == \
+            users[:100]
+        assert len(responses.calls) == 3
+
+    @responses.activate
+    def test_streams_subtree(self):
+        responses.add(responses.GET, 'https://jira.example.com/rest/api/2/issue/createmeta',
+                      body='{"projects": [{"key": "SEN", "issuetypes": ['
+                           '{"id": "1", "fields": {"b": {}, "a": {}}}, {"id": "2", "fields": {}}'
+                           ']}]}')
+        items = self.jira.get_cached_items(self.jira.META_URL, prefix='projects.item.issuetypes.item')
+        assert [t['id'] for t in items] == ['1', '2']
+        assert items[0]['fields'].keys() == ['b', 'a']
+        assert items.checksum == self.jira.get_cached(self.jira.META_URL).checksum
+
+        # hits are only decompressed
+        with mock.patch('sentry_jira.jira.zlib.compressobj') as compressobj:
+            cached = self.jira.get_cached_items(self.jira.META_URL,
+                                                prefix='projects.item.issuetypes.item')
+        assert cached == items
+        assert cached.checksum == items.checksum
+        assert not compressobj.called
+
+    @responses.activate
+    def test_streams_garbage(self):
+        responses.add(responses.GET, 'https://jira.example.com/rest/api/2/project',
+                      body='<html>Oops</html>')
+        assert self.jira.get_cached_items(self.jira.PROJECT_URL) == []
+
+    @responses.activate
+    def test_caches_compact_payload(self):
+        priorities = [{'id': str(i), 'name': 'Priority %d' % i} for i in range(100)]
+        responses.add(responses.GET, 'https://jira.example.com/rest/api/2/priority',
+                      json=priorities)
+        assert self.jira.get_priorities().json == priorities
+
+        cached = cache.get(self.jira.get_cache_key(self.jira.PRIORITIES_URL))
+        fresh_until, (status_code, compressed, payload) = cached
+        assert status_code == 200
+        assert compressed
+
+        response = self.jira.get_priorities()
+        assert len(responses.calls) == 1
+        assert isinstance(response, JIRAResponse)
+        assert response.json == priorities
+
+    def expire(self, url, params=None):
+        key = self.jira.get_cache_key(url, params)
+        fresh_until, data = cache.get(key)
+        cache.set(key, (0, data), 60)
+
+    @responses.activate
+    def test_serves_stale_while_revalidating(self):
+        responses.add(responses.GET, 'https://jira.example.com/rest/api/2/priority',
+                      json=[{'id': '1', 'name': 'Old'}])
+        self.jira.get_priorities()
+        self.expire(self.jira.PRIORITIES_URL)
+
+        responses.reset()
+        responses.add(responses.GET, 'https://jira.example.com/rest/api/2/priority',
+                      json=[{'id': '1', 'name': 'New'}])
+        refreshes = []
+        revalidate = self.jira.revalidate
+        with mock.patch.object(self.jira, 'revalidate',
+                               side_effect=lambda *a: refreshes.append(revalidate(*a))):
+            assert self.jira.get_priorities().json[0]['name'] == 'Old'
+        # the refresh runs on its own worker pool
+        assert refreshes[0].get(5)
+        assert len(responses.calls) == 1
+        assert self.jira.get_priorities().json[0]['name'] == 'New'
+
+    def test_refreshes_once(self):
+        with mock.patch('sentry_jira.jira.revalidation_workers.submit') as submit:
+            assert self.jira.revalidate(self.jira.PRIORITIES_URL) is not None
+            assert self.jira.revalidate(self.jira.PRIORITIES_URL) is None
+        assert submit.call_count == 1
+
+    @responses.activate
+    def test_expired_without_stale_refetches(self):
+        responses.add(responses.GET, 'https://jira.example.com/rest/api/2/issue/SEN-1',
+                      json={'key': 'SEN-1'})
+        self.jira.get_cached(self.jira.ISSUE_URL % 'SEN-1')
+        self.expire(self.jira.ISSUE_URL % 'SEN-1')
+        self.jira.get_cached(self.jira.ISSUE_URL % 'SEN-1')
+        assert len(responses.calls) == 2
+
+
+class SingleFlightTest(TestCase):
+    def run_concurrently(self, func, count=5):
+        results = []
+        self.arrived = []
+
+        def run():
+            self.arrived.append(1)
+            results.append(func())
+
+        threads = [threading.Thread(target=run) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def wait_for_everyone(self, count=5):
+        # hold the leader until every thread got to the single flight
+        deadline = time.time() + 5
+        while len(self.arrived) < count and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.05)
+
+    def test_shares_result(self):
+        calls = []
+
+        def slow():
+            calls.append(1)
+            self.wait_for_everyone()
+            return object()
+
+        flight = SingleFlight()
+        results = self.run_concurrently(lambda: flight.do('key', slow))
+        assert len(calls) == 1
+        assert len(set(results)) == 1
+        assert flight.pending() == 0
+
+    def test_shares_errors(self):
+        flight = SingleFlight()
+
+        def fail():
+            self.wait_for_everyone()
+            raise JIRAError('Internal error', 500)
+
+        def call():
+            try:
+                flight.do('key', fail)
+            except JIRAError as e:
+                return e.status_code
+
+        assert self.run_concurrently(call) == [500] * 5
+        assert flight.pending() == 0
+
+    def test_client_coalesces_identical_gets(self):
+        client = JIRAClient('https://jira.example.com', 'foo', 'bar')
+
+        def make_request(*args, **kwargs):
+            self.wait_for_everyone()
+            return JIRAResponse('[]', 200)
+
+        with mock.patch.object(client, 'make_request', side_effect=make_request) as request:
+            results = self.run_concurrently(client.get_priorities)
+        assert request.call_count == 1
+        assert len(set(results)) == 1
+
+    def test_client_coalesces_identical_streamed_gets(self):
+        client = JIRAClient('https://jira.example.com', 'foo', 'bar')
+
+        def make_request(*args, **kwargs):
+            self.wait_for_everyone()
+            response = mock.Mock(status_code=200)
+            response.iter_content.return_value = iter(['{"projects": [{"key": "SEN"}]}'])
+            return response
+
+        with mock.patch.object(client, 'make_request', side_effect=make_request) as request:
+            results = self.run_concurrently(
+                lambda: client.get_cached_items(client.META_URL, prefix='projects.item'))
+        assert request.call_count == 1
+        assert results == [[{'key': 'SEN'}]] * 5
+
+    def test_waits_on_other_process(self):
+        client = JIRAClient('https://jira.example.com', 'foo', 'bar')
+        client.SHARED_FETCH_WAIT = 2
+        key = client.get_cache_key(client.PRIORITIES_URL)
+        cache.set('%s:fetch' % key, 1, 2)
+        threading.Timer(0.2, lambda: cache.set(
+            key, (time.time() + 60, JIRAResponse('[]', 200).serialize()), 60)).start()
+        with mock.patch.object(client, 'make_request') as request:
+            assert client.get_priorities().json == []
+        assert not request.called
+
+
+class JIRAClientRetryTest(TestCase):
+    @fixture
+    def jira(self):
+        return JIRAClient('https://jira.example.com', 'foo', 'bar')
+
+    @responses.activate
+    def test_retries_with_backoff(self):
+        responses.add(responses.GET, 'https://jira.example.com/rest/api/2/issue/SEN-1',
+                      status=503, json={})
+        responses.add(responses.GET, 'https://jira.example.com/rest/api/2/issue/SEN-1',
+                      json={'key': 'SEN-1'})
+        with mock.patch('sentry_jira.jira.time.sleep') as sleep:
+            assert self.jira.get_issue('SEN-1').json['key'] == 'SEN-1'
+        assert len(responses.calls) == 2
+        assert 0 <= sleep.call_args[0][0] <= self.jira.RETRY_BACKOFF
+
+    @responses.activate
+    def test_honors_retry_after(self):
+        responses.add(responses.POST, 'https://jira.example.com/rest/api/2/issue',
+                      status=429, json={}, adding_headers={'Retry-After': '2'})
+        responses.add(responses.POST, 'https://jira.example.com/rest/api/2/issue',
+                      json={'key': 'SEN-1'})
+        with mock.patch('sentry_jira.jira.time.sleep') as sleep, \
+                mock.patch.object(RateLimiter, 'block') as block:
+            assert self.jira.create_issue({}).json['key'] == 'SEN-1'
+        sleep.assert_called_once_with(2.0)
+        # every other client for the instance holds off as well
+        block.assert_called_once_with(2.0)
+
+    @responses.activate
+    def test_gives_up_past_budget(self):
+        responses.add(responses.GET, 'https://jira.example.com/rest/api/2/issue/SEN-1',
+                      status=429, json={}, adding_headers={'Retry-After': '60'})
+        with mock.patch('sentry_jira.jira.time.sleep') as sleep:
+            with self.assertRaises(JIRAError) as e:
+                self.jira.make_request('get', self.jira.ISSUE_URL % 'SEN-1', budget=10)
+        assert e.exception.status_code == 429
+        assert not sleep.called
+
+    def test_uses_endpoint_timeouts(self):
+        with mock.patch.object(self.jira, '_make_request') as make_request:
+            self.jira.create_issue({})
+            self.jira.get_users_for_project('SEN')
+        timeouts = [c[0][4] for c in make_request.call_args_list]
+        assert timeouts == [self.jira.TIMEOUTS['create'], self.jira.TIMEOUTS['autocomplete']]
+
+    def test_timeouts_fit_in_deadline(self):
+        with mock.patch.object(self.jira, '_make_request') as make_request:
+            self.jira.make_request('get', self.jira.ISSUE_URL % 'SEN-1', endpoint='bulk',
+                                   budget=1)
+        connect, read = make_request.call_args[0][4]
+        assert connect <= 1 and read <= 1
+
+    @responses.activate
+    def test_timeout_fails_past_deadline(self):
+        responses.add(responses.GET, 'https://jira.example.com/rest/api/2/issue/SEN-1',
+                      body=Timeout('Read timed out.'))
+        with mock.patch('sentry_jira.jira.Deadline.remaining', side_effect=[4, 0]):
+            with self.assertRaises(JIRAError) as e:
+                self.jira.get_issue('SEN-1')
+        assert e.exception.status_code == 504
+        assert len(responses.calls) == 1
+
+    @responses.activate
+    def test_does_not_retry_client_errors(self):
+        responses.add(responses.POST, 'https://jira.example.com/rest/api/2/issue',
+                      status=502, json={})
+        with self.assertRaises(JIRAError):
+            self.jira.create_issue({})
+        assert len(responses.calls) == 1
+
+    @responses.activate
+    def test_bulk_creates_in_chunks(self):
+        url = 'https://jira.example.com/rest/api/2/issue/bulk'
+        responses.add(responses.POST, url, json={
+            'issues': [{'key': 'SEN-1'}],
+            'errors': [{'status': 400, 'failedElementNumber': 0,
+                        'elementErrors': {'errors': {'summary': 'required'}}}],
+        })
+        responses.add(responses.POST, url, status=400, json={
+            'issues': [],
+            'errors': [
+                {'status': 400, 'failedElementNumber': i,
+                 'elementErrors': {'errors': {'summary': 'required'}}}
+                for i in range(2)
+            ],
+        })
+        responses.add(responses.POST, url, status=500, body='')
+
+        results = self.jira.create_issues([{}, {'summary': 'a'}, {}, {}, {'summary': 'b'}],
+                                          chunk_size=2)
+        assert len(responses.calls) == 3
+        assert [getattr(r, 'status_code', None) for r in results] == [400, None, 400, 400, 500]
+        assert results[0].json['errors'] == {'summary': 'required'}
+        assert results[1]['key'] == 'SEN-1'
+        assert len(json.loads(responses.calls[0].request.body)['issueUpdates']) == 2
+
+    @responses.activate
+    def test_resolves_renamed_project_keys(self):
+        responses.add(responses.POST, 'https://jira.example.com/rest/api/2/search',
+                      json={'issues': [{'key': 'NEW-1'}, {'key': 'NEW-2'}]})
+        assert self.jira.resolve_issue_keys(['ABC-1', 'ABC-2']) == {
+            'ABC-1': 'NEW-1', 'ABC-2': 'NEW-2'}
+        assert len(responses.calls) == 1
+
+    @responses.activate
+    def test_resolves_deleted_and_moved_keys(self):
+        # ABC-77 was deleted and XYZ-5 moved to NEW-77
+        responses.add(responses.POST, 'https://jira.example.com/rest/api/2/search',
+                      json={'issues': [{'key': 'NEW-77'}]})
+        responses.add(responses.GET, 'https://jira.example.com/rest/api/2/issue/ABC-77',
+                      status=404, json={})
+        responses.add(responses.GET, 'https://jira.example.com/rest/api/2/issue/XYZ-5',
+                      json={'key': 'NEW-77'})
+        assert self.jira.resolve_issue_keys(['ABC-77', 'XYZ-5']) == {'XYZ-5': 'NEW-77'}
+
+    @responses.activate
+    def test_searches_ambiguous_keys_again_in_halves(self):
+        # ABC was renamed to NEW and ABC-3 deleted since
+        def search(request):
+            keys = re.findall(r'"ABC-(\d+)"', json.loads(request.body)['jql'])
+            issues = [{'key': 'NEW-%s' % n} for n in keys if n != '3']
+            return 200, {}, json.dumps({'issues': issues})
+
+        responses.add_callback(responses.POST, 'https://jira.example.com/rest/api/2/search',
+                               callback=search, content_type='application/json')
+        # the last two ambiguous keys are looked up one by one
+        responses.add(responses.GET, 'https://jira.example.com/rest/api/2/issue/ABC-3',
+                      status=404, json={})
+        responses.add(responses.GET, 'https://jira.example.com/rest/api/2/issue/ABC-4',
+                      json={'key': 'NEW-4'})
+        keys = ['ABC-%d' % n for n in range(1, 17)]
+        assert self.jira.resolve_issue_keys(keys) == dict(
+            ('ABC-%d' % n, 'NEW-%d' % n) for n in range(1, 17) if n != 3)
+        assert len(responses.calls) == 9
+        assert [c.request.method for c in responses.calls].count('GET') == 2
+
+
+class RateLimiterTest(TestCase):
+    def test_blocks_everyone(self):
+        limiter = RateLimiter('https://jira.example.com', None)
+        limiter.block(60)
+        with self.assertRaises(JIRAError):
+            RateLimiter('https://jira.example.com', None).acquire(Deadline(1))
+
+    def test_limits_requests_per_second(self):
+        limiter = RateLimiter('https://jira.example.com', 2)
+        with mock.patch('sentry_jira.jira.time.time', return_value=1000.5), \
+                mock.patch('sentry_jira.jira.time.sleep'):
+            limiter.acquire(Deadline(10))
+            limiter.acquire(Deadline(10))
+            with self.assertRaises(JIRAError) as e:
+                limiter.acquire(Deadline(0.1))
+        assert e.exception.status_code == 429
+
+    def test_shared_between_clients(self):
+        first = JIRAClient('https://jira.example.com', 'foo', 'bar')
+        second = JIRAClient('https://jira.example.com/', 'baz', 'qux')
+        assert first.rate_limiter.key == second.rate_limiter.key
+
+
+class CircuitBreakerTest(TestCase):
+    @fixture
+    def jira(self):
+        return JIRAClient('https://jira.example.com', 'foo', 'bar')
+
+    @responses.activate
+    def test_opens_after_consecutive_failures(self):
+        responses.add(responses.GET, 'https://jira.example.com/rest/api/2/issue/SEN-1',
+                      status=500, json={})
+        for _ in range(self.jira.BREAKER_THRESHOLD):
+            with self.assertRaises(JIRAError):
+                self.jira.get_issue('SEN-1')
+        assert len(responses.calls) == self.jira.BREAKER_THRESHOLD
+        assert self.jira.breaker.is_open()
+
+        # shared with every other client of the instance
+        other = JIRAClient('https://jira.example.com', 'baz', 'qux')
+        with self.assertRaises(JIRAUnavailable):
+            other.get_issue('SEN-1')
+        assert len(responses.calls) == self.jira.BREAKER_THRESHOLD
+
+    @responses.activate
+    def test_client_errors_reset_failures(self):
+        responses.add(responses.GET, 'https://jira.example.com/rest/api/2/issue/SEN-1',
+                      status=500, json={})
+        responses.add(responses.GET, 'https://jira.example.com/rest/api/2/issue/SEN-2',
+                      status=404, json={})
+        for key in ['SEN-1'] * 4 + ['SEN-2'] + ['SEN-1'] * 4:
+            with self.assertRaises(JIRAError):
+                self.jira.get_issue(key)
+        assert not self.jira.breaker.is_open()
+
+    def test_half_open_probe(self):
+        breaker = CircuitBreaker('https://jira.example.com', threshold=1, cooldown=30)
+        breaker.record_failure()
+        assert not breaker.allow()
+
+        with mock.patch('sentry_jira.jira.time.time', return_value=time.time() + 31):
+            assert breaker.allow()
+            # only a single probe at a time
+            assert not breaker.allow()
+            breaker.record_failure()
+            assert not breaker.allow()
+
+        breaker.record_success()
+        assert breaker.allow()
+        assert not breaker.is_open()
+
+    def test_probe_closes_after_failures_expired(self):
+        breaker = CircuitBreaker('https://jira.example.com', threshold=1, cooldown=30)
+        breaker.record_failure()
+        # a long outage outlived the failure count
+        cache.delete(breaker.failures_key)
+
+        with mock.patch('sentry_jira.jira.time.time', return_value=time.time() + 31):
+            assert breaker.allow()
+            breaker.record_success()
+            assert breaker.allow()
+            assert breaker.allow()
+        assert not breaker.is_open()
+
+
+class JIRAResponseTest(TestCase):
+    def test_decodes_lazily(self):
+        response = JIRAResponse('{"b": 1, "a": 2}', 200)
+        assert 'json' not in vars(response)
+        assert response.json.keys() == ['b', 'a']
+        assert response.json is response.json
+        assert response.xml is None
+
+    def test_decodes_plain_dicts(self):
+        response = JIRAResponse('{"b": 1, "a": 2}', 200, ordered=False)
+        assert type(response.json) is dict
+        assert response.json == {'a': 2, 'b': 1}
+
+    def test_decodes_xml(self):
+        response = JIRAResponse('<?xml version="1.0"?><users><name>foo</name></users>', 200)
+        assert response.json is None
+        assert response.xml.find('name').text == 'foo'
+
+    def test_streams_xml_records(self):
+        response = JIRAResponse(
+            u'<?xml version="1.0"?><results><users><name>foo</name><html>F&amp;o</html></users>'
+            u'<users><name>b\xe4r</name><html /></users></results>', 200)
+        assert response.xml_records('users') == [
+            {'name': 'foo', 'html': 'F&o'},
+            {'name': u'b\xe4r', 'html': ''},
+        ]
+        assert JIRAResponse('<?xml version="1.0"?><results><users>', 200).xml_records('users') == []
+        assert JIRAResponse('[]', 200).xml_records('users') == []
+
+    def test_error_decodes_lazily(self):
+        error = JIRAError('{"errors": {"summary": "required"}}', 400)
+        assert 'json' not in vars(error)
+        assert error.json['errors']['summary'] == 'required'
+        assert JIRAError('', 500).json is None
+
+
+class StubJIRAHandler(BaseHTTPRequestHandler):
+    routes = {
+        '/rest/api/2/priority': (200, '[{"id": "1", "name": "Highest"}]'),
+        '/rest/api/2/issue/SEN-1': (200, '{"key": "SEN-1"}'),
+    }
+
+    def do_GET(self):
+        status, body = self.routes.get(self.path.split('?')[0], (401, '{}'))
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class AsyncJIRAClientTest(TestCase):
+    def setUp(self):
+        super(AsyncJIRAClientTest, self).setUp()
+        self.server = HTTPServer(('127.0.0.1', 0), StubJIRAHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.jira = AsyncJIRAClient('http://127.0.0.1:%d' % self.server.server_port, 'foo', 'bar')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super(AsyncJIRAClientTest, self).tearDown()
+
+    def test_requests_in_flight(self):
+        results = [self.jira.get_issue('SEN-1') for _ in range(5)]
+        priorities = self.jira.get_priorities()
+        assert [r.get(timeout=5).json['key'] for r in results] == ['SEN-1'] * 5
+        assert priorities.get(timeout=5).json == [{'id': '1', 'name': 'Highest'}]
+
+    def test_shares_cache_with_sync_client(self):
+        self.jira.get_priorities().get(timeout=5)
+        self.server.shutdown()
+        assert self.jira.client.get_priorities().json[0]['name'] == 'Highest'
+
+    def test_deadline_expires(self):
+        wait = threading.Event()
+        result = self.jira.submit(wait.wait)
+        with self.assertRaises(JIRAError) as e:
+            Deadline(0.1).wait(result)
+        assert e.exception.status_code == 504
+        wait.set()
+
+    def test_raises_jira_errors(self):
+        result = self.jira.get_projects_list()
+        with self.assertRaises(JIRAUnauthorized):
+            result.get(timeout=5)
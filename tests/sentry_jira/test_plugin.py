@@ -1,6 +1,9 @@
 from __future__ import absolute_import
 
+import mock
 import responses
+import time
+import urlparse
 
 from django.core.urlresolvers import reverse
 from exam import fixture
@@ -8,8 +11,11 @@ from sentry.models import GroupMeta
 from sentry.plugins import register, unregister
 from sentry.testutils import TestCase
 from sentry.utils import json
+from sentry.utils.cache import cache
 
+from sentry_jira.jira import JIRAClient, JIRAError, JIRAUnavailable
 from sentry_jira.plugin import JIRAPlugin
+from sentry_jira.tasks import ISSUE_KEY_CHECK_QUEUED, ISSUE_KEY_VERIFIED, auto_create_issue
 
 
 def jira_mock():
@@ -257,6 +263,12 @@ def jira_mock():
     # }
     mock.add(mock.GET, 'https://getsentry.atlassian.net/rest/api/2/issue/createmeta',
              json=create_meta_response)
+    mock.add(mock.GET, 'https://getsentry.atlassian.net/rest/api/2/issue/createmeta/SEN/issuetypes',
+             json={'startAt': 0, 'maxResults': 50, 'total': 0, 'isLast': True, 'values': []})
+    for issue_type in create_meta_response['projects'][0]['issuetypes']:
+        fields = [dict(meta, fieldId=field) for field, meta in issue_type['fields'].items()]
+        mock.add(mock.GET, 'https://getsentry.atlassian.net/rest/api/2/issue/createmeta/SEN/issuetypes/%s' % issue_type['id'],
+                 json={'startAt': 0, 'maxResults': 200, 'total': len(fields), 'isLast': True, 'values': fields})
     mock.add(mock.POST, 'https://getsentry.atlassian.net/rest/api/2/issue',
              json={'key': 'SEN-1234'})
     return mock
@@ -309,6 +321,167 @@ class JIRAPluginTest(TestCase):
 
         assert response.status_code == 200, vars(response)
         self.assertTemplateUsed(response, 'sentry_jira/create_jira_issue.html')
+        assert response.context['autocomplete_delay'] == plugin.AUTOCOMPLETE_DELAY
+
+        plugin.set_option('autocomplete_delay', 500, project)
+        with jira_mock():
+            response = self.client.get(self.action_path)
+        assert response.context['autocomplete_delay'] == 500
+
+    def test_user_autocomplete_pages(self):
+        project = self.project
+        plugin = self.plugin
+
+        plugin.set_option('username', 'foo', project)
+        plugin.set_option('password', 'bar', project)
+        plugin.set_option('instance_url', 'https://getsentry.atlassian.net', project)
+        plugin.set_option('default_project', 'SEN', project)
+
+        users = [{
+            'name': 'user%d' % i,
+            'displayName': 'User %d' % i,
+            'emailAddress': 'user%d@example.com' % i,
+        } for i in range(120)]
+
+        def search(request):
+            query = urlparse.parse_qs(urlparse.urlsplit(request.url).query)
+            start_at, max_results = int(query['startAt'][0]), int(query['maxResults'][0])
+            return 200, {}, json.dumps(users[start_at:start_at + max_results])
+
+        self.login_as(self.user)
+        url = 'https://getsentry.atlassian.net/rest/api/latest/user/assignable/search?issueKey=null&username='
+        with responses.RequestsMock() as mock:
+            mock.add_callback(mock.GET, 'https://getsentry.atlassian.net/rest/api/2/user/assignable/search',
+                              callback=search)
+            response = self.client.get(self.action_path, {'user_autocomplete': url, 'q': ''})
+            data = json.loads(response.content)
+            assert [u['value'] for u in data['users']] == ['user%d' % i for i in range(50)]
+            assert data['more']
+
+            response = self.client.get(self.action_path, {'user_autocomplete': url, 'q': '', 'page': 3})
+            data = json.loads(response.content)
+            assert [u['value'] for u in data['users']] == ['user%d' % i for i in range(100, 120)]
+            assert not data['more']
+            # pages of users come from the cache
+            assert len(mock.calls) == 2
+
+    def test_user_autocomplete_from_index(self):
+        project = self.project
+        plugin = self.plugin
+
+        plugin.set_option('username', 'foo', project)
+        plugin.set_option('password', 'bar', project)
+        plugin.set_option('instance_url', 'https://getsentry.atlassian.net', project)
+        plugin.set_option('default_project', 'SEN', project)
+
+        self.login_as(self.user)
+        url = 'https://getsentry.atlassian.net/rest/api/latest/user/assignable/search?issueKey=null&username='
+        with responses.RequestsMock() as mock:
+            users = [{'name': 'jdoe', 'displayName': 'Jane Doe', 'emailAddress': 'jane@example.com'}]
+            mock.add(mock.GET, 'https://getsentry.atlassian.net/rest/api/2/user/assignable/search',
+                     json=users)
+            mock.add(mock.GET, 'https://getsentry.atlassian.net/rest/api/latest/user/assignable/search',
+                     json=users)
+            # nothing indexed yet, JIRA is asked and the index gets built
+            with self.tasks():
+                response = self.client.get(self.action_path, {'user_autocomplete': url, 'q': 'jan'})
+            assert [u['value'] for u in json.loads(response.content)['users']] == ['jdoe']
+            assert len(mock.calls) == 2
+
+            response = self.client.get(self.action_path, {'user_autocomplete': url, 'q': 'doe'})
+            assert [u['value'] for u in json.loads(response.content)['users']] == ['jdoe']
+            assert len(mock.calls) == 2
+
+            # nobody matching locally, ask JIRA
+            self.client.get(self.action_path, {'user_autocomplete': url, 'q': 'bob'})
+            assert len(mock.calls) == 3
+
+            # other user pickers search more than the assignable users
+            mock.add(mock.GET, 'https://getsentry.atlassian.net/rest/api/latest/user/search',
+                     json=users)
+            reporter_url = 'https://getsentry.atlassian.net/rest/api/latest/user/search?username='
+            self.client.get(self.action_path, {'user_autocomplete': reporter_url, 'q': 'doe'})
+            assert len(mock.calls) == 4
+            assert '/user/search' in mock.calls[3].request.url
+
+    def test_user_autocomplete_reuses_complete_prefix(self):
+        project = self.project
+        plugin = self.plugin
+
+        plugin.set_option('username', 'foo', project)
+        plugin.set_option('password', 'bar', project)
+        plugin.set_option('instance_url', 'https://getsentry.atlassian.net', project)
+        plugin.set_option('default_project', 'SEN', project)
+
+        self.login_as(self.user)
+        url = 'https://getsentry.atlassian.net/rest/api/latest/user/assignable/search?issueKey=null&username='
+        with responses.RequestsMock() as jira, \
+                mock.patch.object(JIRAPlugin, 'get_user_index', return_value=None):
+            jira.add(jira.GET, 'https://getsentry.atlassian.net/rest/api/latest/user/assignable/search', json=[
+                {'name': 'alex', 'displayName': 'Alex Smith', 'emailAddress': 'alex@example.com'},
+                {'name': 'alexandra', 'displayName': 'Alexandra Doe', 'emailAddress': 'ad@example.com'},
+            ])
+            response = self.client.get(self.action_path, {'user_autocomplete': url, 'q': 'al'})
+            assert len(json.loads(response.content)['users']) == 2
+            assert 'maxResults=50' in jira.calls[0].request.url
+
+            for q in ('ale', 'alexa', 'alexandr'):
+                response = self.client.get(self.action_path, {'user_autocomplete': url, 'q': q})
+            assert [u['value'] for u in json.loads(response.content)['users']] == ['alexandra']
+            assert len(jira.calls) == 1
+
+    def test_user_autocomplete_incomplete_prefix(self):
+        project = self.project
+        plugin = self.plugin
+
+        plugin.set_option('username', 'foo', project)
+        plugin.set_option('password', 'bar', project)
+        plugin.set_option('instance_url', 'https://getsentry.atlassian.net', project)
+        plugin.set_option('default_project', 'SEN', project)
+
+        self.login_as(self.user)
+        url = 'https://getsentry.atlassian.net/rest/api/latest/user/assignable/search?issueKey=null&username='
+        with responses.RequestsMock() as jira, \
+                mock.patch.object(JIRAPlugin, 'get_user_index', return_value=None), \
+                mock.patch.object(JIRAPlugin, 'USER_SEARCH_LIMIT', 2):
+            jira.add(jira.GET, 'https://getsentry.atlassian.net/rest/api/latest/user/assignable/search', json=[
+                {'name': 'alex', 'displayName': 'Alex Smith', 'emailAddress': 'alex@example.com'},
+                {'name': 'alexandra', 'displayName': 'Alexandra Doe', 'emailAddress': 'ad@example.com'},
+            ])
+            self.client.get(self.action_path, {'user_autocomplete': url, 'q': 'al'})
+            # JIRA might have had more to say about "al"
+            self.client.get(self.action_path, {'user_autocomplete': url, 'q': 'alexa'})
+            assert len(jira.calls) == 2
+
+    def test_user_autocomplete_xml(self):
+        project = self.project
+        plugin = self.plugin
+
+        plugin.set_option('username', 'foo', project)
+        plugin.set_option('password', 'bar', project)
+        plugin.set_option('instance_url', 'https://getsentry.atlassian.net', project)
+        plugin.set_option('default_project', 'SEN', project)
+
+        self.login_as(self.user)
+        url = 'https://getsentry.atlassian.net/secure/UserPickerBrowser.jspa?fieldName=assignee'
+        with responses.RequestsMock() as jira, \
+                mock.patch.object(JIRAPlugin, 'get_user_index', return_value=None):
+            jira.add(
+                jira.GET, 'https://getsentry.atlassian.net/secure/UserPickerBrowser.jspa',
+                content_type='text/xml',
+                body='<?xml version="1.0" encoding="UTF-8"?><userPickerResults>'
+                     '<users><name>alex</name><html>&lt;b&gt;Al&lt;/b&gt;ex - alex@example.com</html></users>'
+                     '<users><name>alfred</name><html>&lt;b&gt;Al&lt;/b&gt;fred</html></users>'
+                     '</userPickerResults>')
+            response = self.client.get(self.action_path, {'user_autocomplete': url, 'q': 'al'})
+            assert 'query=al' in jira.calls[0].request.url
+
+        assert json.loads(response.content)['users'] == [
+            {'value': 'alex', 'display': '&lt;b&gt;Al&lt;/b&gt;ex - alex@example.com',
+             'needsRender': False, 'q': 'al'},
+            {'value': 'alfred', 'display': '&lt;b&gt;Al&lt;/b&gt;fred',
+             'needsRender': False, 'q': 'al'},
+        ]
 
     def test_create_issue_saves(self):
         project = self.project
@@ -352,6 +525,30 @@ class JIRAPluginTest(TestCase):
             }
 
     @responses.activate
+    def test_create_issue_invalidates_only_on_schema_errors(self):
+        plugin = self.plugin
+        plugin.set_option('instance_url', 'https://getsentry.atlassian.net', self.project)
+        plugin.set_option('default_project', 'SEN', self.project)
+        field_plan = mock.Mock(converters={'summary': None, 'customfield_10001': None})
+
+        with responses.RequestsMock() as jira, \
+                mock.patch.object(JIRAClient, 'invalidate_project') as invalidate:
+            jira.add(jira.POST, 'https://getsentry.atlassian.net/rest/api/2/issue', status=400, json={
+                'errors': {'customfield_10001': 'Field is required.'}, 'errorMessages': [],
+            })
+            jira.add(jira.POST, 'https://getsentry.atlassian.net/rest/api/2/issue', status=400, json={
+                'errors': {'customfield_10002': 'Field is required.'}, 'errorMessages': [],
+            })
+
+            # a mistake in the form
+            issue_id, errors = plugin.create_issue(None, self.group, {'summary': 'a'}, field_plan)
+            assert errors['customfield_10001'] == ['Field is required.']
+            assert not invalidate.called
+
+            # JIRA wants a field the form doesn't know of
+            plugin.create_issue(None, self.group, {'summary': 'a'}, field_plan)
+            invalidate.assert_called_once_with('SEN')
+
     def test_create_issue_with_fetch_errors(self):
         project = self.project
         plugin = self.plugin
@@ -368,6 +565,49 @@ class JIRAPluginTest(TestCase):
         assert response.status_code == 200, vars(response)
         self.assertTemplateUsed(response, 'sentry_jira/plugin_misconfigured.html')
 
+    def test_create_issue_fails_fast_when_jira_is_down(self):
+        project = self.project
+        plugin = self.plugin
+
+        plugin.set_option('username', 'foo', project)
+        plugin.set_option('password', 'bar', project)
+        plugin.set_option('instance_url', 'https://getsentry.atlassian.net', project)
+        plugin.set_option('default_project', 'SEN', project)
+
+        breaker = plugin.get_jira_client(project).breaker
+        for _ in range(breaker.threshold):
+            breaker.record_failure()
+
+        self.login_as(self.user)
+
+        with jira_mock() as mock_jira:
+            response = self.client.get(self.action_path)
+            assert not mock_jira.calls
+
+        assert response.status_code == 200, vars(response)
+        self.assertTemplateUsed(response, 'sentry_jira/plugin_misconfigured.html')
+        assert 'JIRA is currently unavailable' in response.content
+
+    def test_create_issue_while_jira_is_probed(self):
+        project = self.project
+        plugin = self.plugin
+
+        plugin.set_option('username', 'foo', project)
+        plugin.set_option('password', 'bar', project)
+        plugin.set_option('instance_url', 'https://getsentry.atlassian.net', project)
+        plugin.set_option('default_project', 'SEN', project)
+
+        self.login_as(self.user)
+
+        # the breaker is half open and someone else got to probe JIRA
+        error = JIRAUnavailable('JIRA is currently unavailable, please try again later.')
+        with mock.patch.object(JIRAPlugin, 'new_issue_form', side_effect=error):
+            response = self.client.get(self.action_path)
+
+        assert response.status_code == 200, vars(response)
+        self.assertTemplateUsed(response, 'sentry_jira/plugin_misconfigured.html')
+        assert 'JIRA is currently unavailable' in response.content
+
     def test_configure_renders(self):
         self.login_as(self.user)
         with jira_mock():
@@ -416,3 +656,239 @@ class JIRAPluginTest(TestCase):
         self.assertTemplateUsed(response, 'sentry_jira/project_conf_form.html')
 
         assert 'ignored_fields' in response.content
+
+    @responses.activate
+    def test_update_issue_keys(self):
+        project = self.project
+        plugin = self.plugin
+
+        plugin.set_option('username', 'foo', project)
+        plugin.set_option('password', 'bar', project)
+        plugin.set_option('instance_url', 'https://getsentry.atlassian.net', project)
+
+        groups = [self.group] + [self.create_group(message='Group %d' % i) for i in range(3)]
+        for group, key in zip(groups, ['SEN-1', 'OLD-2', 'OLD-3', 'OLD-4']):
+            GroupMeta.objects.set_value(group, 'jira:tid', key)
+        other_group = self.create_group(project=self.create_project(), message='Other')
+        GroupMeta.objects.set_value(other_group, 'jira:tid', 'OLD-2')
+
+        responses.add(responses.POST, 'https://getsentry.atlassian.net/rest/api/2/search',
+                      json={'issues': [{'key': 'SEN-1'}, {'key': 'NEW-2'}]})
+        responses.add(responses.POST, 'https://getsentry.atlassian.net/rest/api/2/search',
+                      json={'issues': [{'key': 'NEW-3'}]})
+        responses.add(responses.GET, 'https://getsentry.atlassian.net/rest/api/2/issue/OLD-3',
+                      json={'key': 'NEW-3'})
+        responses.add(responses.GET, 'https://getsentry.atlassian.net/rest/api/2/issue/OLD-4',
+                      status=404, json={})
+
+        assert plugin.update_issue_keys(project, batch_size=2) == 2
+        # OLD-4 is gone, so NEW-3 might as well have come from it
+        assert len(responses.calls) == 4
+        assert 'key in (\\"SEN-1\\", \\"OLD-2\\")' in responses.calls[0].request.body
+
+        values = dict(GroupMeta.objects.filter(key='jira:tid').values_list('group', 'value'))
+        assert values == {
+            groups[0].id: 'SEN-1',
+            groups[1].id: 'NEW-2',
+            groups[2].id: 'NEW-3',
+            groups[3].id: 'OLD-4',
+            other_group.id: 'OLD-2',
+        }
+
+    def test_view_linked_issue_skips_jira(self):
+        plugin = self.plugin
+        plugin.set_option('username', 'foo', self.project)
+        plugin.set_option('password', 'bar', self.project)
+        plugin.set_option('instance_url', 'https://getsentry.atlassian.net', self.project)
+        plugin.set_option('default_project', 'SEN', self.project)
+        GroupMeta.objects.set_value(self.group, 'jira:tid', 'SEN-1')
+
+        self.login_as(self.user)
+        with responses.RequestsMock(), \
+                mock.patch('sentry_jira.plugin.verify_issue_key') as task:
+            response = self.client.get(self.action_path)
+            assert response.status_code == 302
+            task.delay.assert_called_once_with(group_id=self.group.id)
+
+            # already queued
+            self.client.get(self.action_path)
+            assert task.delay.call_count == 1
+
+            # the check didn't get through to JIRA, so it is tried again
+            cache.delete(ISSUE_KEY_CHECK_QUEUED % self.group.id)
+            self.client.get(self.action_path)
+            assert task.delay.call_count == 2
+
+            # verified recently enough
+            cache.delete(ISSUE_KEY_CHECK_QUEUED % self.group.id)
+            cache.set(ISSUE_KEY_VERIFIED % self.group.id, time.time())
+            self.client.get(self.action_path)
+            assert task.delay.call_count == 2
+
+            # unless asked for
+            self.client.get(self.action_path, {'update_key': '1'})
+            assert task.delay.call_count == 3
+
+    def test_actions_batches_issue_key_lookups(self):
+        self.plugin.set_option('instance_url', 'https://getsentry.atlassian.net', self.project)
+        groups = [self.group] + [self.create_group(message='Group %d' % i) for i in range(3)]
+        GroupMeta.objects.set_value(groups[1], 'jira:tid', 'SEN-1')
+        GroupMeta.objects.clear_local_cache()
+        # options come from their own cache
+        self.plugin.actions(None, groups[0], [])
+
+        with self.assertNumQueries(1):
+            assert self.plugin.get_issue_keys(groups) == {
+                groups[0]: None, groups[1]: 'SEN-1', groups[2]: None, groups[3]: None,
+            }
+        with self.assertNumQueries(0):
+            actions = [self.plugin.actions(None, group, []) for group in groups]
+        assert actions[1][0] == ('View JIRA: SEN-1', 'https://getsentry.atlassian.net/browse/SEN-1')
+        assert actions[2] == [('Create JIRA Issue', self.plugin.get_url(groups[2]))]
+
+    @responses.activate
+    def test_create_issues(self):
+        self.configure_auto_create()
+        groups = [self.group]
+        for i in range(3):
+            group = self.create_group(message='Group %d' % i)
+            self.create_event(group=group)
+            groups.append(group)
+        GroupMeta.objects.set_value(groups[3], 'jira:tid', 'SEN-1')
+
+        responses.add(responses.POST, 'https://getsentry.atlassian.net/rest/api/2/issue/bulk', json={
+            'issues': [{'key': 'SEN-2'}, {'key': 'SEN-4'}],
+            'errors': [{
+                'status': 400,
+                'failedElementNumber': 1,
+                'elementErrors': {'errors': {'summary': 'too long'}, 'errorMessages': []},
+            }],
+        })
+        responses.add(
+            responses.GET, 'https://getsentry.atlassian.net/rest/api/2/issue/createmeta/SEN/issuetypes',
+            json={'values': [{'id': '10002'}], 'total': 1})
+        responses.add(
+            responses.GET, 'https://getsentry.atlassian.net/rest/api/2/issue/createmeta/SEN/issuetypes/10002',
+            json={'values': [{'fieldId': 'summary'}], 'total': 1})
+        with mock.patch.object(JIRAClient, 'invalidate_project') as invalidate:
+            results = self.plugin.create_issues({}, groups)
+        # JIRA knows the summary field as we do
+        assert not invalidate.called
+
+        assert len(responses.calls) == 3
+        issues = json.loads(responses.calls[0].request.body)['issueUpdates']
+        assert len(issues) == 3
+        assert issues[0]['fields']['project'] == {'key': 'SEN'}
+        assert issues[0]['fields']['issuetype'] == {'id': '10002'}
+
+        assert results == {
+            groups[0].id: ('SEN-2', None),
+            groups[1].id: (None, {'summary': ['too long'], '__all__': [[]]}),
+            groups[2].id: ('SEN-4', None),
+            groups[3].id: ('SEN-1', None),
+        }
+        values = dict(GroupMeta.objects.filter(key='jira:tid').values_list('group', 'value'))
+        assert values == {groups[0].id: 'SEN-2', groups[2].id: 'SEN-4', groups[3].id: 'SEN-1'}
+
+    @responses.activate
+    def test_create_issues_links_despite_odd_errors(self):
+        self.configure_auto_create()
+        group = self.create_group(message='Other')
+        self.create_event(group=group)
+
+        responses.add(responses.POST, 'https://getsentry.atlassian.net/rest/api/2/issue/bulk', json={
+            'issues': [{'key': 'SEN-2'}],
+            'errors': [
+                {'status': 400, 'failedElementNumber': 1, 'elementErrors': {'errors': 'odd'}},
+                {'status': 400, 'failedElementNumber': 7},
+            ],
+        })
+        results = self.plugin.create_issues({}, [self.group, group])
+
+        assert results == {
+            self.group.id: ('SEN-2', None),
+            group.id: (None, {'__all__': [[]]}),
+        }
+        assert GroupMeta.objects.get(group=self.group, key='jira:tid').value == 'SEN-2'
+        assert self.plugin.get_create_errors(JIRAError('<html>Oops</html>', 400)) == {
+            '__all__': [[]]}
+
+    def configure_auto_create(self):
+        project = self.project
+        plugin = self.plugin
+
+        plugin.set_option('username', 'foo', project)
+        plugin.set_option('password', 'bar', project)
+        plugin.set_option('instance_url', 'https://getsentry.atlassian.net', project)
+        plugin.set_option('default_project', 'SEN', project)
+        plugin.set_option('default_priority', '1', project)
+        plugin.set_option('default_issue_type', '10002', project)
+        plugin.set_option('auto_create', True, project)
+
+    def test_post_process_enqueues_auto_create(self):
+        self.configure_auto_create()
+
+        with mock.patch('sentry_jira.plugin.auto_create_issue') as task:
+            self.plugin.post_process(self.group, self.event, is_new=True, is_sample=False)
+
+            # a concurrent worker seeing the same new group backs off
+            self.plugin.post_process(self.group, self.event, is_new=True, is_sample=False)
+
+        task.delay.assert_called_once_with(
+            group_id=self.group.id,
+            event_id=self.event.id,
+            project_key='SEN',
+            priority='1',
+            issue_type='10002',
+            token=mock.ANY,
+        )
+
+    def test_post_process_auto_creates(self):
+        self.configure_auto_create()
+
+        with jira_mock() as mock_jira, self.tasks():
+            self.plugin.post_process(self.group, self.event, is_new=True, is_sample=False)
+
+            jira_request = mock_jira.calls[-1].request
+            assert jira_request.url == 'https://getsentry.atlassian.net/rest/api/2/issue'
+            fields = json.loads(jira_request.body)['fields']
+            assert fields['project'] == {'id': '10000'}
+            assert fields['priority'] == {'id': '1'}
+            assert fields['issuetype'] == {'id': '10002'}
+
+        assert GroupMeta.objects.get(group=self.group, key='jira:tid').value == 'SEN-1234'
+
+    def test_post_process_retries_auto_create(self):
+        self.configure_auto_create()
+
+        # leave retrying to the task only
+        with jira_mock() as mock_jira, self.tasks(), \
+                mock.patch.object(JIRAClient, 'MAX_RETRIES', 0):
+            mock_jira.replace(mock_jira.POST, 'https://getsentry.atlassian.net/rest/api/2/issue',
+                              status=503, json={})
+            mock_jira.add(mock_jira.POST, 'https://getsentry.atlassian.net/rest/api/2/search',
+                          json={'issues': []})
+            with self.assertRaises(JIRAError):
+                self.plugin.post_process(self.group, self.event, is_new=True, is_sample=False)
+
+            urls = [c.request.url for c in mock_jira.calls if c.request.method == 'POST']
+            assert urls.count('https://getsentry.atlassian.net/rest/api/2/issue') == 6
+            assert urls.count('https://getsentry.atlassian.net/rest/api/2/search') == 5
+
+        assert not GroupMeta.objects.filter(group=self.group, key='jira:tid').exists()
+
+    def test_auto_create_retry_finds_existing_ticket(self):
+        self.configure_auto_create()
+        cache.set('jira-auto-create-attempt:abc', True)
+
+        with jira_mock() as mock_jira, self.tasks():
+            mock_jira.add(mock_jira.POST, 'https://getsentry.atlassian.net/rest/api/2/search',
+                          json={'issues': [{'key': 'SEN-999'}]})
+            auto_create_issue(group_id=self.group.id, event_id=self.event.id, project_key='SEN',
+                              priority='1', issue_type='10002', token='abc')
+
+            jira_request = mock_jira.calls[-1].request
+            assert jira_request.url == 'https://getsentry.atlassian.net/rest/api/2/search'
+            assert 'project = \\"SEN\\" AND description' in jira_request.body
+
+        assert GroupMeta.objects.get(group=self.group, key='jira:tid').value == 'SEN-999'
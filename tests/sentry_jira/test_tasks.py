@@ -0,0 +1,173 @@
+from __future__ import absolute_import
+
+import mock
+import responses
+
+from exam import fixture
+from sentry.models import GroupMeta
+from sentry.plugins import register, unregister
+from sentry.testutils import TestCase
+from sentry.utils.cache import cache
+
+from sentry_jira.plugin import JIRAPlugin
+from sentry_jira.tasks import ISSUE_KEY_VERIFIED, IssueKeyMigration, migrate_issue_keys
+from sentry_jira.tasks import verify_issue_key, warm_metadata_cache
+from sentry_jira.users import user_directory
+
+
+def jira_search_mock():
+    def search(request):
+        keys = request.body.split('(')[1].split(')')[0]
+        issues = [{'key': k.strip(' \\"').replace('OLD', 'NEW')} for k in keys.split(',')]
+        return 200, {}, '{"issues": [%s]}' % ', '.join('{"key": "%s"}' % i['key'] for i in issues)
+
+    mock = responses.RequestsMock(assert_all_requests_are_fired=False)
+    mock.add_callback(mock.POST, 'https://getsentry.atlassian.net/rest/api/2/search',
+                      callback=search)
+    return mock
+
+
+class MigrateIssueKeysTest(TestCase):
+    plugin_cls = JIRAPlugin
+
+    def setUp(self):
+        super(MigrateIssueKeysTest, self).setUp()
+        register(self.plugin_cls)
+        self.plugin.set_option('username', 'foo', self.project)
+        self.plugin.set_option('password', 'bar', self.project)
+        self.plugin.set_option('instance_url', 'https://getsentry.atlassian.net', self.project)
+        self.groups = [self.create_group(message='Group %d' % i) for i in range(5)]
+        for i, group in enumerate(self.groups):
+            GroupMeta.objects.set_value(group, 'jira:tid', 'OLD-%d' % i)
+
+    def tearDown(self):
+        unregister(self.plugin_cls)
+        super(MigrateIssueKeysTest, self).tearDown()
+
+    @fixture
+    def plugin(self):
+        return self.plugin_cls()
+
+    def get_keys(self):
+        return sorted(GroupMeta.objects.filter(key='jira:tid').values_list('value', flat=True))
+
+    def test_migrates_all_partitions(self):
+        with jira_search_mock(), self.tasks():
+            migrate_issue_keys(project_id=self.project.id, partitions=2, batch_size=2, rate_limit=0)
+
+        assert self.get_keys() == ['NEW-%d' % i for i in range(5)]
+        status = IssueKeyMigration(self.project, self.plugin).get_status()
+        assert status['done']
+        assert status['total'] == status['processed'] == status['updated'] == 5
+        assert status['eta'] == 0
+
+    def test_resumes_from_checkpoint(self):
+        refresh = self.plugin_cls.refresh_issue_keys
+        calls = []
+
+        def flaky_refresh(plugin, client, rows, batch_size=None):
+            calls.append([value for _, value in rows])
+            if len(calls) == 2:
+                raise Exception('worker died')
+            return refresh(plugin, client, rows, batch_size)
+
+        with jira_search_mock(), self.tasks(), \
+                mock.patch.object(self.plugin_cls, 'refresh_issue_keys', flaky_refresh):
+            with self.assertRaises(Exception):
+                migrate_issue_keys(project_id=self.project.id, partitions=1, batch_size=2,
+                                   rate_limit=0)
+            assert self.get_keys() == ['NEW-0', 'NEW-1', 'OLD-2', 'OLD-3', 'OLD-4']
+
+            status = IssueKeyMigration(self.project, self.plugin).get_status()
+            assert not status['done']
+            assert status['processed'] == 2
+
+            migrate_issue_keys(project_id=self.project.id)
+
+        assert calls == [['OLD-0', 'OLD-1'], ['OLD-2', 'OLD-3'], ['OLD-2', 'OLD-3'], ['OLD-4']]
+        assert self.get_keys() == ['NEW-%d' % i for i in range(5)]
+        assert IssueKeyMigration(self.project, self.plugin).get_status()['done']
+
+    def test_skips_running_partitions(self):
+        migration = IssueKeyMigration(self.project, self.plugin)
+        migration.plan(partitions=2, batch_size=2, rate_limit=0)
+
+        # another worker is still busy with the first partition
+        with migration.get_lock(0).acquire():
+            with jira_search_mock(), self.tasks():
+                migrate_issue_keys(project_id=self.project.id)
+                assert migration.running_partitions() == [0]
+                assert [p['done'] for p in migration.get_partitions()] == [False, True]
+
+                # nor is it planned over
+                migrate_issue_keys(project_id=self.project.id, partitions=1, restart=True)
+                assert len(migration.get_partitions()) == 2
+
+        with jira_search_mock(), self.tasks():
+            migrate_issue_keys(project_id=self.project.id)
+        assert self.get_keys() == ['NEW-%d' % i for i in range(5)]
+        assert migration.running_partitions() == []
+
+    @responses.activate
+    def test_verifies_single_issue_key(self):
+        group = self.groups[0]
+        responses.add(responses.GET, 'https://getsentry.atlassian.net/rest/api/2/issue/OLD-0',
+                      json={'key': 'NEW-0'})
+        verify_issue_key(group_id=group.id)
+        assert GroupMeta.objects.get(group=group, key='jira:tid').value == 'NEW-0'
+        assert cache.get(ISSUE_KEY_VERIFIED % group.id) is not None
+
+        # JIRA being unreachable isn't taken for verified
+        verify_issue_key(group_id=self.groups[1].id)
+        assert cache.get(ISSUE_KEY_VERIFIED % self.groups[1].id) is None
+
+
+class WarmMetadataCacheTest(TestCase):
+    plugin_cls = JIRAPlugin
+
+    def setUp(self):
+        super(WarmMetadataCacheTest, self).setUp()
+        register(self.plugin_cls)
+        self.plugin.set_option('username', 'foo', self.project)
+        self.plugin.set_option('password', 'bar', self.project)
+        self.plugin.set_option('instance_url', 'https://getsentry.atlassian.net', self.project)
+        self.plugin.set_option('default_project', 'SEN', self.project)
+        self.plugin.set_option('enabled', True, self.project)
+
+    def tearDown(self):
+        unregister(self.plugin_cls)
+        super(WarmMetadataCacheTest, self).tearDown()
+
+    @fixture
+    def plugin(self):
+        return self.plugin_cls()
+
+    @responses.activate
+    def test_warms_configured_projects(self):
+        base = 'https://getsentry.atlassian.net/rest/api/2'
+        responses.add(responses.GET, base + '/project', json=[])
+        responses.add(responses.GET, base + '/priority', json=[])
+        responses.add(responses.GET, base + '/project/SEN/versions', json=[])
+        responses.add(responses.GET, base + '/issue/createmeta', json={'projects': []})
+        responses.add(responses.GET, base + '/user/assignable/search', json=[
+            {'name': 'jane', 'displayName': 'Jane Doe', 'emailAddress': 'jane@example.com'},
+        ])
+        # not configured, left alone
+        self.create_project(name='Other')
+
+        with self.tasks():
+            warm_metadata_cache()
+        assert len(responses.calls) == 5
+
+        # nothing is about to expire
+        with self.tasks(), mock.patch('sentry_jira.tasks.WARM_UP_INTERVAL', 0):
+            warm_metadata_cache()
+        assert len(responses.calls) == 5
+
+        client = self.plugin.get_jira_client(self.project)
+        assert user_directory.get(client, 'SEN').search('doe') == [
+            ('jane', 'Jane Doe', 'jane@example.com')]
+
+        client.get_create_meta('SEN')
+        client.get_priorities()
+        assert len(responses.calls) == 5
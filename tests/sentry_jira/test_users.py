@@ -0,0 +1,60 @@
+from __future__ import absolute_import
+
+import mock
+import responses
+
+from sentry.testutils import TestCase
+
+from sentry_jira.jira import JIRAClient
+from sentry_jira.users import UserDirectory, UserIndex
+
+
+class UserIndexTest(TestCase):
+    users = [
+        ('jdoe', 'Jane Doe', 'jane@example.com'),
+        ('alex', 'Alexander Smith', 'asmith@example.com'),
+        ('alexandra', 'Alexandra Doe', 'alexandra@example.org'),
+    ]
+
+    def test_searches_by_prefix(self):
+        index = UserIndex(self.users)
+        assert index.search('doe') == [self.users[0], self.users[2]]
+        assert index.search('ALEX') == [self.users[1], self.users[2]]
+        assert index.search('alexandr') == [self.users[2]]
+        assert index.search('asmith@') == [self.users[1]]
+        assert index.search('jane@example.com') == [self.users[0]]
+        assert index.search('bob') == []
+
+    def test_limits_results(self):
+        index = UserIndex(self.users)
+        assert index.search('a', limit=1) == [self.users[1]]
+
+
+class UserDirectoryTest(TestCase):
+    def setUp(self):
+        super(UserDirectoryTest, self).setUp()
+        self.jira = JIRAClient('https://jira.example.com', 'foo', 'bar')
+        self.directory = UserDirectory()
+
+    @responses.activate
+    def test_builds_index_once_per_refresh(self):
+        responses.add(responses.GET, 'https://jira.example.com/rest/api/2/user/assignable/search',
+                      json=[{'name': 'jdoe', 'displayName': 'Jane Doe', 'emailAddress': 'jane@example.com'}])
+        assert self.directory.get(self.jira, 'SEN') is None
+        assert self.directory.refresh(self.jira, 'SEN') == 1
+
+        index = self.directory.get(self.jira, 'SEN')
+        assert index.search('jane') == [('jdoe', 'Jane Doe', 'jane@example.com')]
+        assert self.directory.get(self.jira, 'SEN') is index
+        assert self.directory.get(self.jira, 'FOO') is None
+
+        self.directory.refresh(self.jira, 'SEN')
+        assert self.directory.get(self.jira, 'SEN') is not index
+
+    @responses.activate
+    def test_stale_index(self):
+        responses.add(responses.GET, 'https://jira.example.com/rest/api/2/user/assignable/search',
+                      json=[])
+        self.directory.refresh(self.jira, 'SEN')
+        with mock.patch('sentry_jira.users.time.time', return_value=2e9):
+            assert self.directory.get(self.jira, 'SEN') is None